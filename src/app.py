@@ -1,22 +1,36 @@
+import asyncio
 import datetime
 import html
 import json
 import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
-from typing import Optional
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
+import uvicorn
+from telegram import (Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember,
+                      InlineQueryResultArticle, InputTextMessageContent)
 from telegram.constants import ParseMode
-from const import DbType, MALE_MONOLOGUES, FEMALE_MONOLOGUES, MENU, CONTINUE, END
-from env import BOT_TOKEN, DEVELOPER_CHAT_ID
+from const import DbType, MALE_MONOLOGUES, FEMALE_MONOLOGUES, MENU, CONTINUE, END, RESULT_PAGE
+from cache import ResultCache
+from env import (BOT_TOKEN, DEVELOPER_CHAT_ID, SEARCH_CONCURRENCY, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL,
+                 SEARCH_CACHE_BYTES, INLINE_DEBOUNCE, PORT, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_WORKERS)
+from locks import update_lock
+from outbound import OutboundRateLimiter
+from roles import is_banned, role_service
 from updater import update_monologues
-from search import search_monologue
+from render import paginate
+from search import rank_fragments, complete_monologues, load_indexes, start_index_watcher, indexes_generation
+from webhook import WebhookApp, WEBHOOK_PATH
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    ApplicationHandlerStop,
     CommandHandler,
     CallbackContext,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
+    TypeHandler,
     MessageHandler,
     filters, ContextTypes
 )
@@ -33,50 +47,115 @@ logger = logging.getLogger("httpx")
 # Loading conversations
 conversation = ConversationText()
 
+# Only the updates with a handler are sent by Telegram
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
 
-async def start(update: Update, context: CallbackContext) -> int:
+# Searches run in a bounded pool of threads, so the event loop keeps
+# serving the other updates while they are in flight
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix="search")
+search_slots = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
+# Rendered answers of the popular searches, dropped when the database changes.
+# Bounded by their size too, the answer of a short keyword may list every title
+search_cache = ResultCache(max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+                           max_bytes=SEARCH_CACHE_BYTES,
+                           sizeof=lambda pages: sum(len(page.encode()) for page in pages))
+
+# Key in user_data of the pages of the last search results
+RESULTS_KEY = "results"
+
+# The article bodies contain the common words too, only the best matches are listed
+BODY_RESULTS = 30
+
+# Results of an inline query, for each schema
+INLINE_RESULTS = 10
+# Seconds the clients may cache the answer of an inline query
+INLINE_CACHE_TIME = 300
+INLINE_LABELS = {DbType.MALE: "Monologo maschile", DbType.FEMALE: "Monologo femminile"}
+
+# Answers of the inline queries, typed again by many users while typing
+inline_cache = ResultCache(max_size=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+# Last inline query of each user, the older ones are not answered
+inline_latest: dict[int, str] = {}
+
+
+# Prompts of the search menu, by chosen schema
+SEARCH_PROMPTS = {
+    MALE_MONOLOGUES: "Bene! inserisci delle parole per la tua ricerca",
+    FEMALE_MONOLOGUES: "Bene! cerchiamo monologhi femminili",
+}
+
+
+def menu_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton("Maschili", callback_data=str(MALE_MONOLOGUES))],
         [InlineKeyboardButton("Femminili", callback_data=str(FEMALE_MONOLOGUES))],
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(conversation.type(ConversationType.WELCOME).random().get(), reply_markup=reply_markup
-    )
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def start(update: Update, context: CallbackContext) -> int:
+    await update.message.reply_text(conversation.type(ConversationType.WELCOME).random().get(),
+                                    reply_markup=menu_keyboard())
     return MENU
 
 
+def is_results_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    True if the callback query comes from the buttons of the message with the
+    last search results, see "send_results".
+    """
+    cursor = context.user_data.get(RESULTS_KEY)
+    message = update.callback_query.message
+    return cursor is not None and message is not None and cursor.get("message_id") == message.message_id
+
+
 async def menu_handler(update: Update, context: CallbackContext) -> int:
+    """
+    Buttons of the menu. Each one costs a single request counted by the flood
+    control of the chat: on the results message only the buttons change, so
+    the results stay, and the texts are shown in the answer of the query.
+    """
     query = update.callback_query
-    await query.answer()
 
-    if query.data == str(MALE_MONOLOGUES):
-        await query.edit_message_text(text="Bene! inserisci delle parole per la tua ricerca")
-        return MALE_MONOLOGUES
-    elif query.data == str(FEMALE_MONOLOGUES):
-        await query.edit_message_text(text="Bene! cerchiamo monologhi femminili")
-        return FEMALE_MONOLOGUES
+    if query.data in (str(MALE_MONOLOGUES), str(FEMALE_MONOLOGUES)):
+        state = int(query.data)
+        if is_results_message(update, context):
+            await query.answer(SEARCH_PROMPTS[state])
+            await query.edit_message_reply_markup(reply_markup=None)
+        else:
+            await query.answer()
+            await query.edit_message_text(text=SEARCH_PROMPTS[state])
+        return state
     elif query.data == str(CONTINUE):
-        await start_over(update, context)
+        return await start_over(update, context)
     elif query.data == str(END):
-        await query.edit_message_text(text=conversation.type(ConversationType.CONTINUE_NO).random().get())
+        await query.answer(conversation.type(ConversationType.CONTINUE_NO).random().get())
+        await query.edit_message_reply_markup(reply_markup=None)
         return ConversationHandler.END
     else:
+        await query.answer()
         await query.edit_message_text(text="Operazione non disponibile")
         return MENU
 
 
 async def start_over(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """New search for monologues"""
+    """New search for monologues, the menu replaces the buttons of the results"""
     query = update.callback_query
-    keyboard = [
-        [InlineKeyboardButton("Maschili", callback_data=str(MALE_MONOLOGUES))],
-        [InlineKeyboardButton("Femminili", callback_data=str(FEMALE_MONOLOGUES))],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(conversation.type(ConversationType.CONTINUE_YES).random().get(), reply_markup=reply_markup
-    )
+    await query.answer(conversation.type(ConversationType.CONTINUE_YES).random().get())
+    await query.edit_message_reply_markup(reply_markup=menu_keyboard())
     return MENU
 
+async def drop_banned(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Pre-handler of every update, the ones of banned users are dropped.
+    The role is checked in memory, see roles.RoleService.
+    """
+    user = update.effective_user
+    if user is not None and is_banned(user.id):
+        raise ApplicationHandlerStop
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a telegram message to notify the developer."""
     # Log the error before we do anything else, so we can see it even if something breaks.
@@ -104,15 +183,22 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
     )
 
-def main():
-    application = (
+def build_application(webhook: bool = False) -> Application:
+    """
+    Create the bot with all its handlers.
+    :param webhook: updates are pushed by Telegram to "webhook.WebhookApp", no polling
+    """
+    builder = (
         ApplicationBuilder()
         .token(BOT_TOKEN)
         .read_timeout(10)
         .write_timeout(10)
         .concurrent_updates(True)
-        .build()
+        .rate_limiter(OutboundRateLimiter())
     )
+    if webhook:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # ConversationHandler to handle the state machine
     conv_handler = ConversationHandler(
@@ -129,15 +215,71 @@ def main():
         fallbacks=[CommandHandler("start", start)],
     )
 
+    # Updates of banned users stop here, before any other handler
+    application.add_handler(TypeHandler(Update, drop_banned), group=-1)
+
+    # "@bot amleto" in any chat, no conversation needed
+    application.add_handler(InlineQueryHandler(inline_search))
+
+    # Pages of the results can be browsed whatever the state of the conversation
+    application.add_handler(CallbackQueryHandler(result_page, pattern=rf"^{RESULT_PAGE}:\d+:\d+$"))
     application.add_handler(conv_handler)
     application.add_error_handler(error_handler)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
+
+
+def create_webhook_app() -> WebhookApp:
+    """
+    ASGI app of a webhook worker, see "run_webhook".
+    Every worker process has its own bot and search indexes.
+    """
+    role_service.load()
+    load_indexes()
+    start_index_watcher()
+    return WebhookApp(build_application(webhook=True), WEBHOOK_SECRET)
+
+
+def run_webhook() -> None:
+    """
+    Register the webhook on Telegram and serve it with uvicorn
+    on PORT with WEBHOOK_WORKERS processes.
+    Telegram only calls https urls: with a plain http WEBHOOK_URL, e.g. for
+    local tests with recorded updates, the webhook is served but not registered.
+    """
+    if WEBHOOK_URL.startswith("https://"):
+        bot = Bot(BOT_TOKEN)
+        asyncio.run(bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                                    secret_token=WEBHOOK_SECRET,
+                                    allowed_updates=ALLOWED_UPDATES,
+                                    max_connections=WEBHOOK_WORKERS * SEARCH_CONCURRENCY))
+    else:
+        logger.warning(f"Webhook url [{WEBHOOK_URL}] is not https, serving without registering it")
+
+    # Workers import this module again, the factory builds their app
+    uvicorn.run("app:create_webhook_app", factory=True, host="0.0.0.0", port=PORT, workers=WEBHOOK_WORKERS)
+
+
+def main():
+    if WEBHOOK_URL:
+        run_webhook()
+        return
+
+    # Roles are checked for every update, read them before serving any
+    role_service.load()
+
+    # Read the database once, searches are served from memory
+    # and the indexes are rebuilt in background after each update
+    load_indexes()
+    start_index_watcher()
+
+    application = build_application()
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 async def update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Manually triggers update of monologues.
-    Calls the task "update_monologues".
+    Calls the task "update_monologues", or joins the running one.
     """
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
@@ -148,9 +290,15 @@ async def update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check if user is admin or creator
     if member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
 
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="Sto aggiornando i monologhi, torna più tardi")
-        update_monologues.delay(DbType.MALE)
-        update_monologues.apply_async(countdown=3600)
+        # Triggers while an update is running join it, the task checks again
+        # on start so a race here only costs a no-op task
+        if await asyncio.to_thread(update_lock.is_locked, DbType.MALE):
+            await context.bot.send_message(chat_id=update.effective_chat.id,
+                                           text="Aggiornamento già in corso, mi unisco a quello. Torna più tardi")
+        else:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="Sto aggiornando i monologhi, torna più tardi")
+            update_monologues.delay(DbType.MALE.value)
+        update_monologues.apply_async(args=(DbType.FEMALE.value,), countdown=3600)
 
     else:
         await update.message.reply_text("Comando riservato per utenti amministratori")
@@ -158,83 +306,189 @@ async def update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def search_male(update: Update, context: ContextTypes.DEFAULT_TYPE):
     key_list = [sub for sub in update.message.text.split()]
-    text = search(search_str=key_list, db_type=DbType.MALE)
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=text,
-        parse_mode=ParseMode.HTML)
-
-    keyboard = [
-        [
-            InlineKeyboardButton("Continua", callback_data=str(CONTINUE)),
-            InlineKeyboardButton("Esci", callback_data=str(END)),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(conversation.type(ConversationType.CONTINUE_QUESTION).random().get(), reply_markup=reply_markup)
+    pages = await search_async(search_str=key_list, db_type=DbType.MALE)
+    await send_results(update, context, pages)
     return MENU
 
 
 async def search_female(update: Update, context: ContextTypes.DEFAULT_TYPE):
     key_list = [sub for sub in update.message.text.split()]
-    text = search(search_str=key_list, db_type=DbType.FEMALE)
-    await context.bot.send_message(
+    pages = await search_async(search_str=key_list, db_type=DbType.FEMALE)
+    await send_results(update, context, pages)
+    return MENU
+
+
+def results_keyboard(search_id: int, page: int, pages: int) -> InlineKeyboardMarkup:
+    """
+    Buttons of the results message: browse the pages, when they do not
+    fit in one message, then continue searching or exit.
+    """
+    keyboard = []
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀ Indietro", callback_data=f"{RESULT_PAGE}:{search_id}:{page - 1}"))
+    if page + 1 < pages:
+        buttons.append(InlineKeyboardButton(f"Avanti ({page + 2}/{pages}) ▶",
+                                            callback_data=f"{RESULT_PAGE}:{search_id}:{page + 1}"))
+    if buttons:
+        keyboard.append(buttons)
+    keyboard.append([
+        InlineKeyboardButton("Continua", callback_data=str(CONTINUE)),
+        InlineKeyboardButton("Esci", callback_data=str(END)),
+    ])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def send_results(update: Update, context: ContextTypes.DEFAULT_TYPE, pages: tuple[str, ...]) -> None:
+    """
+    Send the first page of the results, in a single message with all the
+    buttons, and keep all of them in user_data: the next ones are served
+    from there by "result_page" without searching again.
+    """
+    cursor = context.user_data.get(RESULTS_KEY)
+    search_id = cursor["id"] + 1 if cursor else 0
+    cursor = {"id": search_id, "pages": pages, "page": 0, "message_id": None}
+    context.user_data[RESULTS_KEY] = cursor
+
+    message = await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text=text,
-        parse_mode=ParseMode.HTML)
+        text=pages[0],
+        parse_mode=ParseMode.HTML,
+        reply_markup=results_keyboard(search_id, 0, len(pages)))
+    cursor["message_id"] = message.message_id
+
+
+async def result_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show another page of the last search results, see "send_results"."""
+    query = update.callback_query
+    _, search_id, page = query.data.split(":")
+    search_id, page = int(search_id), int(page)
+
+    # Buttons of an older search, its results are gone
+    cursor = context.user_data.get(RESULTS_KEY)
+    if cursor is None or cursor["id"] != search_id or page >= len(cursor["pages"]):
+        await query.answer("Ricerca scaduta, fanne una nuova")
+        await query.edit_message_reply_markup(reply_markup=None)
+        return
+
+    await query.answer()
+    cursor["page"] = page
+    await query.edit_message_text(
+        text=cursor["pages"][page],
+        parse_mode=ParseMode.HTML,
+        reply_markup=results_keyboard(search_id, page, len(cursor["pages"])))
+
+
+async def search_async(search_str: list[str], db_type: DbType) -> tuple[str, ...]:
+    """
+    Run "search" in the search executor without blocking the event loop.
+    Waits for a free slot when SEARCH_CONCURRENCY searches are already running.
+    """
+    async with search_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(search_executor, search, search_str, db_type)
 
-    keyboard = [
-        [
-            InlineKeyboardButton("Continua", callback_data=str(CONTINUE)),
-            InlineKeyboardButton("Esci", callback_data=str(END)),
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(conversation.type(ConversationType.CONTINUE_QUESTION).random().get(), reply_markup=reply_markup)
-    return MENU
 
+def search(search_str: list[str], db_type: DbType) -> tuple[str, ...]:
+    """
+    Search the monologues and render the answer, served from the
+    cache when the same keywords have been searched recently.
+    :return: the pages of the answer, see render.paginate
+    """
+    # Case does not change the results, the order does: the
+    # article bodies with the keywords as typed come first
+    key = (db_type, tuple(elem.casefold() for elem in search_str))
+    generation = indexes_generation()
 
-def search(search_str: list[str], db_type: DbType) -> Optional[str]:
+    pages = search_cache.get(key, generation)
+    if pages is None:
+        pages = _search(search_str, db_type)
+        search_cache.put(key, generation, pages)
+    return pages
 
-    found_monologues = set()
-    for elem in search_str:
-        res = search_monologue(db_type, elem)
-        found_monologues.update(res)
 
-    result_size = len(found_monologues)
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Answer an inline query with the monologues of both the schemas whose title
+    matches what has been typed so far. Clients send a query per keystroke:
+    a query is answered only if no newer one of the same user arrives within
+    INLINE_DEBOUNCE seconds.
+    """
+    query = update.inline_query
+    user_id = query.from_user.id
+    inline_latest[user_id] = query.id
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    if inline_latest.get(user_id) != query.id:
+        return
+    del inline_latest[user_id]
 
-    # Prevent returning too many elements
-    # Telegram API has a limit of 4096 in message size
-    # User may have searched a two letter string like "ab"
-    text = ""
-    if result_size:
-        if result_size == 0:
-            text = "Mmm sembra che non ci sia nulla"
-        elif result_size == 1:
-            monologue = found_monologues.pop()
-            text = "<b>Trovato un solo monologo</b>\n"
-            text = text + "<b>Nome:</b> " + monologue.text + "\n"
-            text = text + "<b>Url:</b> <a href=\"" + monologue.url + "\">" + monologue.url + "</a>\n"
+    # Served from the resident indexes in well under a millisecond,
+    # cheaper to run here than to hand over to the search executor
+    results = inline_results(query.query)
+    await query.answer(results, cache_time=INLINE_CACHE_TIME)
+
+
+def inline_results(text: str) -> list[InlineQueryResultArticle]:
+    """
+    Results of an inline query, served from the cache when the same text
+    has been typed recently.
+    """
+    # Spaces matter, a trailing one completes the last word
+    key = " ".join(text.casefold().split()) + (" " if text[-1:].isspace() else "")
+    generation = indexes_generation()
+
+    results = inline_cache.get(key, generation)
+    if results is None:
+        results = []
+        for db_type in DbType:
+            for title, url, fragment in complete_monologues(db_type, key, limit=INLINE_RESULTS):
+                results.append(InlineQueryResultArticle(
+                    id=str(len(results)),
+                    title=title,
+                    description=INLINE_LABELS[db_type],
+                    url=url,
+                    input_message_content=InputTextMessageContent(fragment, parse_mode=ParseMode.HTML)))
+        inline_cache.put(key, generation, results)
+    return results
+
+
+def _search(search_str: list[str], db_type: DbType) -> tuple[str, ...]:
+
+    # All the hits are rendered, best first, and split in
+    # pages that fit the message size limit of Telegram
+    result_size, fragments = rank_fragments(db_type, search_str)
+
+    # Then the monologues with the keywords in the text but not in the title
+    in_title = {fragment for fragment, _ in fragments}
+    body_size, body_fragments = rank_fragments(db_type, search_str, limit=BODY_RESULTS, in_body=True)
+    body_fragments = [fragment for fragment in body_fragments if fragment[0] not in in_title]
+
+    header = ""
+
+    # Nothing matched exactly, the user may have made a typo
+    if result_size == 0 and not body_fragments:
+        result_size, fragments = rank_fragments(db_type, search_str, fuzzy=True)
+        if result_size:
+            header = "<i>Nessun risultato esatto, forse cercavi:</i>\n"
+
+    if result_size == 0 and not body_fragments:
+        return "Mmm sembra che non ci sia nulla",
+    elif result_size == 1:
+        header += "<b>Trovato un solo monologo</b>\n"
+    elif result_size > 1:
+        header += f"<b>Trovati {result_size} monologhi:</b>\n"
+
+    if body_fragments:
+        # All the monologues with the words in the text, the list skips those
+        # already found by title and stops at BODY_RESULTS
+        if body_size == 1:
+            section = "\n<b>Parole trovate nel testo di un solo monologo:</b>\n"
+        elif len(body_fragments) < body_size:
+            section = f"\n<b>Parole trovate nel testo di {body_size} monologhi, i più pertinenti:</b>\n"
         else:
-            # Limiting answers
-            if result_size > 10:
-                limited_response = [found_monologues.pop() for _ in range(10)]
-                found_monologues = limited_response
-
-                full_search_string = ""
-                for elem in search_str:
-                    full_search_string += f"{elem} "
-
-                if len(full_search_string) <= 3:
-                    text = "<i>Attenzione: la tua chiave di ricerca è corta.\nAlcuni risultati potrebbero essere troncati.</i>\n"
-
-            text = text + f"<b>Trovati {result_size} monologhi:</b>\n"
-            for monologue in found_monologues:
-                text = text + "<b>Nome:</b> " + monologue.text + "\n"
-                text = text + "<b>Url:</b> <a href=\"" + monologue.url + "\">" + monologue.url + "</a>\n"
-    else:
-        text = "Mmm sembra che non ci sia nulla"
-    return text
+            section = f"\n<b>Parole trovate nel testo di {body_size} monologhi:</b>\n"
+        fragments = [*fragments, (section, len(section.encode())), *body_fragments]
+    return paginate(header, fragments)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Lookups between two logs of the cache stats
+STATS_LOG_EVERY = 1000
+
+
+class ResultCache:
+    """
+    Bounded LRU cache with a time to live, safe to share between threads.
+    Entries belong to a database generation: an entry stored for an older
+    generation is a miss, so a new database invalidates the whole cache
+    without clearing it.
+
+    Values may differ a lot in size, e.g. every title of a schema for a
+    one letter search: with "max_bytes" the cache is also bounded by the
+    total size of its values, measured by "sizeof", and a value bigger
+    than "max_bytes" alone is not cached at all.
+
+    Example:
+        cache = ResultCache(max_size=512, ttl=3600, max_bytes=32 << 20, sizeof=len)
+        value = cache.get(key, generation)
+        if value is None:
+            value = compute()
+            cache.put(key, generation, value)
+    """
+
+    def __init__(self, max_size: int, ttl: float, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        # key -> (generation, expiry, size, value), least recently used first
+        self._entries: OrderedDict[Hashable, tuple[int, float, int, Any]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        """
+        :param key: the cache key
+        :param generation: the current database generation
+        :return: the cached value, None on miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                value = entry[3]
+            else:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                value = None
+
+            lookups = self.hits + self.misses
+        if lookups % STATS_LOG_EVERY == 0:
+            logger.info(f"CACHE - {self.stats()}")
+        return value
+
+    def put(self, key: Hashable, generation: int, value: Any) -> None:
+        size = self._sizeof(value) if self._sizeof is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (generation, time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_size or (self.max_bytes is not None
+                                                          and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable) -> None:
+        self._bytes -= self._entries.pop(key)[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Counters to size the cache.
+        :return: dict with "hits", "misses", "hit_rate", "size" and "bytes"
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "size": len(self._entries),
+                "bytes": self._bytes,
+            }
@@ -8,15 +8,18 @@ app.conf.update(
     result_backend=REDIS_HOST,
     beat_schedule={
         'update_male_monologues': {
-            'task': 'tasks.update_monologues',
+            'task': 'updater.update_monologues',
             'schedule': crontab(hour='0', minute='10'),
-            'args': (DbType.MALE,)
+            'args': (DbType.MALE.value,)
         },
         'update_female_monologues': {
-            'task': 'tasks.update_monologues',
+            'task': 'updater.update_monologues',
             'schedule': crontab(hour='1', minute='10'),
-            'args': (DbType.FEMALE,)
+            'args': (DbType.FEMALE.value,)
         }
     },
-    include=['tasks']
+    # DbType travels as its value, tasks convert it back
+    task_serializer='json',
+    result_serializer='json',
+    include=['updater']
 )
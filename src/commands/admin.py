@@ -2,7 +2,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from const import MENU
-from roles import is_creator, set_role, is_admin_or_creator, user_roles, save_roles, get_role
+from roles import is_banned, is_creator, set_role, is_admin_or_creator, ROLE_ADMIN, ROLE_BANNED, ROLE_USER
 from utils.helper import resolve_user
 
 
@@ -21,7 +21,7 @@ async def promote(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Couldn't find user.")
         return MENU
 
-    set_role(target_id, "admin")
+    set_role(target_id, ROLE_ADMIN)
     await update.message.reply_text(f"User {target_id} promoted to admin.")
     return MENU
 
@@ -36,8 +36,7 @@ async def ban(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MENU
 
     target_id = context.args[0]
-    user_roles[target_id] = "banned"
-    save_roles(user_roles)
+    set_role(target_id, ROLE_BANNED)
     await update.message.reply_text(f"User {target_id} is now banned.")
     return MENU
 
@@ -52,18 +51,16 @@ async def unban(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MENU
 
     target_id = context.args[0]
-    user_roles[target_id] = "user"
-    save_roles(user_roles)
+    set_role(target_id, ROLE_USER)
     await update.message.reply_text(f"User {target_id} is now unbanned.")
     return MENU
 
 async def admin_feature(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    role = get_role(user_id)
-    if role == "banned":
+    if is_banned(user_id):
         await update.message.reply_text("You are banned.")
         return MENU
-    elif role not in ["admin", "creator"]:
+    elif not is_admin_or_creator(user_id):
         await update.message.reply_text("Admins only.")
         return MENU
     await update.message.reply_text("Admin feature accessed!")
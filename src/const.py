@@ -14,3 +14,6 @@ URL_BY_TYPE = {
 # States for the BOT state machine
 START_ROUTES, END_ROUTES = range(2)
 MENU, MALE_MONOLOGUES, FEMALE_MONOLOGUES, CONTINUE, END = range(5)
+
+# Prefix of the callback data of the buttons browsing the search results
+RESULT_PAGE = "page"
@@ -1,4 +1,5 @@
 import os
+import secrets
 if os.path.exists(".env"):
     # if we see the .env file, load it
     from dotenv import load_dotenv
@@ -9,4 +10,30 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 BOT_USERNAME = os.getenv('BOT_USERNAME')
 PORT = int(os.environ.get('PORT', 5000))
 REDIS_HOST = os.getenv('REDIS_HOST')
-DEVELOPER_CHAT_ID = os.getenv('DEVELOPER_CHAT_ID')
\ No newline at end of file
+# Public https url of the bot, updates are pushed there instead of polled when set
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+# Token Telegram sends with every update to the webhook, generated when missing
+# and kept in the environment so the webhook workers share it
+WEBHOOK_SECRET = os.environ.setdefault('WEBHOOK_SECRET', secrets.token_urlsafe(32))
+# Processes serving the webhook. Conversations and user data live in the process
+# that handled them, with more than one a chat may lose its conversation state
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 1))
+DEVELOPER_CHAT_ID = os.getenv('DEVELOPER_CHAT_ID')
+# Max number of searches running at the same time outside the event loop
+SEARCH_CONCURRENCY = int(os.environ.get('SEARCH_CONCURRENCY', 4))
+# Pages of the blog scraped at the same time by an update
+SCRAPER_WORKERS = int(os.environ.get('SCRAPER_WORKERS', 4))
+# Min seconds between two requests to the blog, whatever the number of threads
+# and Celery workers: the workers share the limit through Redis
+SCRAPER_MIN_INTERVAL = float(os.environ.get('SCRAPER_MIN_INTERVAL', 1.0))
+# Seconds between two checks for a new database in the bot, updates are also pushed on Redis
+INDEX_RELOAD_INTERVAL = float(os.environ.get('INDEX_RELOAD_INTERVAL', 60))
+# Rendered search answers kept in memory and their time to live in seconds
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 512))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 3600))
+# Max total size in bytes of the rendered answers kept, a short keyword may match every title
+SEARCH_CACHE_BYTES = int(os.environ.get('SEARCH_CACHE_BYTES', 32 << 20))
+# Seconds an inline query waits for the next keystroke before being answered
+INLINE_DEBOUNCE = float(os.environ.get('INLINE_DEBOUNCE', 0.25))
+# Where the roles of the users are kept: "json" (roles.json), "sqlite" (database.db) or "redis"
+ROLES_BACKEND = os.environ.get('ROLES_BACKEND', 'json')
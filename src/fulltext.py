@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from itertools import accumulate
+from typing import Iterable, Optional
+
+from fuzzy import fold
+
+# BM25 parameters, the usual defaults
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"\w+")
+
+
+# Folding a word at a time, the vocabulary is much smaller than the corpus
+_fold_word = lru_cache(maxsize=1 << 16)(fold)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Words of a text, casefolded and without accents like the titles
+    of the fuzzy search, e.g "Perché no" becomes ["perche", "no"].
+    """
+    return [_fold_word(word) for word in _WORD.findall(text)]
+
+
+class Postings:
+    """
+    Positional posting list of a word, stored in flat arrays of integers:
+    the documents containing the word, in ascending order, and all the
+    positions of the word in them. The positions of docs[i] are
+    positions[offsets[i]:offsets[i + 1]].
+    """
+
+    __slots__ = ("docs", "offsets", "positions")
+
+    def __init__(self, docs: array, offsets: array, positions: array):
+        self.docs = docs
+        self.offsets = offsets
+        self.positions = positions
+
+    def extended(self, docs: list[int], counts: list[int], positions: list[int]) -> Postings:
+        """
+        New posting list with the positions of some more documents,
+        which must come after the ones already indexed.
+        :param docs: the new documents
+        :param counts: number of positions of each new document
+        :param positions: the positions of all the new documents, one after the other
+        """
+        offsets = accumulate(counts, initial=self.offsets[-1])
+        next(offsets)
+        return Postings(self.docs + array("I", docs),
+                        self.offsets + array("I", offsets),
+                        self.positions + array("I", positions))
+
+
+_EMPTY = Postings(array("I"), array("I", [0]), array("I"))
+
+
+class BodyIndex:
+    """
+    Positional inverted index of the article bodies of a schema,
+    ranked with BM25.
+
+    The index is read only: "extended" returns a new index with some
+    more bodies, sharing the posting lists of the words they do not
+    contain, so an update costs the new bodies and not the whole corpus.
+
+    Example:
+        index = BodyIndex().extended([(1, "https://...", "Essere o non essere")])
+        total, best = index.search(["essere", "non"], required=set(), limit=10)
+    """
+
+    def __init__(self):
+        self.urls: tuple[str, ...] = ()
+        self.lengths = array("I")
+        self.total_length = 0
+        # Id of the last body indexed, the next ones are read after it
+        self.last_id = 0
+        self._postings: dict[str, Postings] = {}
+
+    def extended(self, bodies: Iterable[tuple[int, str, str]]) -> BodyIndex:
+        """
+        :param bodies: (id, url, text) of the new bodies, by ascending id
+        :return: a new index, this one is left untouched
+        """
+        urls = list(self.urls)
+        lengths = array("I", self.lengths)
+        total_length = self.total_length
+        last_id = self.last_id
+        # docs, counts and positions of the new bodies by word
+        new_postings: dict[str, tuple[list[int], list[int], list[int]]] = defaultdict(lambda: ([], [], []))
+
+        for body_id, url, text in bodies:
+            last_id = max(last_id, body_id)
+            words = tokenize(text)
+            if not words:
+                continue
+            doc = len(urls)
+            urls.append(url)
+            lengths.append(len(words))
+            total_length += len(words)
+
+            positions = defaultdict(list)
+            for position, word in enumerate(words):
+                positions[word].append(position)
+            for word, word_positions in positions.items():
+                docs, counts, all_positions = new_postings[word]
+                docs.append(doc)
+                counts.append(len(word_positions))
+                all_positions.extend(word_positions)
+
+        index = BodyIndex()
+        index.urls = tuple(urls)
+        index.lengths = lengths
+        index.total_length = total_length
+        index.last_id = last_id
+        index._postings = dict(self._postings)
+        for word, (docs, counts, positions) in new_postings.items():
+            index._postings[word] = self._postings.get(word, _EMPTY).extended(docs, counts, positions)
+        return index
+
+    def search(self, words: list[str], required: set[str], limit: Optional[int] = None) -> tuple[int, list[int]]:
+        """
+        Documents containing the words, folded with "tokenize".
+        The documents containing the words one after the other, in the
+        order of the query, come first, then the others by BM25 score.
+        :param words: the words of the query, in order
+        :param required: words that must all be in the document, the others match in OR
+        :param limit: max number of documents to return, None for all of them
+        :return: total number of hits and the top "limit" documents, best first
+        """
+        terms = list(dict.fromkeys(words))
+        postings = {term: self._postings.get(term, _EMPTY) for term in terms}
+        if any(not len(postings[term].docs) for term in required):
+            return 0, []
+
+        documents = len(self.urls)
+        average_length = self.total_length / documents if documents else 0
+        scores: dict[int, float] = defaultdict(float)
+        matched: dict[int, dict[str, int]] = defaultdict(dict)
+        for term in terms:
+            posting = postings[term]
+            frequency = len(posting.docs)
+            if frequency == 0:
+                continue
+            idf = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+            for i, doc in enumerate(posting.docs):
+                tf = posting.offsets[i + 1] - posting.offsets[i]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / average_length)
+                scores[doc] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                matched[doc][term] = i
+
+        if required:
+            hits = [doc for doc, found in matched.items() if required.issubset(found)]
+        else:
+            hits = list(scores)
+
+        def has_phrase(doc: int) -> bool:
+            found = matched[doc]
+            return len(found) == len(terms) and self._has_phrase(words, postings, found)
+
+        if limit is None:
+            best = sorted(hits, key=lambda doc: (has_phrase(doc), scores[doc], -doc), reverse=True)
+        elif len(words) < 2:
+            best = heapq.nlargest(limit, hits, key=lambda doc: (scores[doc], -doc))
+        else:
+            # Positions are checked by descending score until "limit"
+            # documents with the phrase are found, the usual case for
+            # common words, instead of checking every hit
+            ranked = sorted(hits, key=lambda doc: (scores[doc], -doc), reverse=True)
+            phrases = []
+            for doc in ranked:
+                if len(phrases) == limit:
+                    break
+                if has_phrase(doc):
+                    phrases.append(doc)
+            in_phrases = set(phrases)
+            best = phrases + [doc for doc in ranked[:limit] if doc not in in_phrases][:limit - len(phrases)]
+        return len(hits), best
+
+    @staticmethod
+    def _has_phrase(words: list[str], postings: dict[str, Postings], found: dict[str, int]) -> bool:
+        # found is the index of the document in the posting list of each word
+        if len(words) < 2:
+            return False
+
+        def bounds(word: str) -> tuple[array, int, int]:
+            posting, i = postings[word], found[word]
+            return posting.positions, posting.offsets[i], posting.offsets[i + 1]
+
+        # Each position of the rarest word in the document is a candidate
+        # start, the other words are looked up by bisection
+        spans = [bounds(word) for word in words]
+        rarest = min(range(len(words)), key=lambda k: spans[k][2] - spans[k][1])
+        positions, low, high = spans[rarest]
+        for position in positions[low:high]:
+            start = position - rarest
+            for shift, (other, other_low, other_high) in enumerate(spans):
+                target = start + shift
+                i = bisect_left(other, target, other_low, other_high)
+                if i == other_high or other[i] != target:
+                    break
+            else:
+                return True
+        return False
+
+    def __len__(self):
+        return len(self.urls)
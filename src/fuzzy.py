@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import unicodedata
+from collections import defaultdict
+from typing import Iterable, Optional
+
+
+def fold(text: str) -> str:
+    """
+    Casefold the text and strip the accents,
+    e.g "Perché" becomes "perche".
+    :param text: text to fold
+    :return: folded text
+    """
+    decomposed = unicodedata.normalize("NFD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def max_distance(word: str) -> int:
+    """
+    Typos tolerated for a word, short words must match
+    exactly (accents apart) or everything would match.
+    :param word: the folded word
+    :return: max edit distance
+    """
+    if len(word) <= 3:
+        return 0
+    if len(word) <= 6:
+        return 1
+    return 2
+
+
+def damerau_levenshtein(a: str, b: str, limit: Optional[int] = None) -> int:
+    """
+    Edit distance between two strings, the swap of two adjacent characters
+    counts as one edit like an insertion, deletion or substitution.
+    It is the optimal string alignment distance: a swapped pair is not
+    edited again, e.g "ca" to "abc" is 3 and not 2.
+    :param a: first string
+    :param b: second string
+    :param limit: stop as soon as the distance is known to be above limit
+    :return: the distance, or a value above limit when limit is exceeded
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            distance = min(previous[j] + 1,
+                           current[j - 1] + 1,
+                           previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def _deletes(word: str, distance: int) -> set[str]:
+    """
+    The word itself and every string obtained deleting
+    up to "distance" characters from it.
+    """
+    found = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+class DeletionIndex:
+    """
+    SymSpell-like deletion dictionary over a vocabulary.
+    Every word is stored under all its deletes up to MAX_DISTANCE, so two
+    words within that edit distance always share a key. A query generates
+    its own deletes and checks only the words found under them, with the
+    Damerau-Levenshtein distance: swapped letters, the most common typo,
+    are a single edit.
+    """
+
+    MAX_DISTANCE = 2
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._deletes: dict[str, list[str]] = defaultdict(list)
+        self._size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str) -> None:
+        for delete in _deletes(word, self.MAX_DISTANCE):
+            self._deletes[delete].append(word)
+        self._size += 1
+
+    def search(self, word: str, distance: int) -> list[tuple[int, str]]:
+        """
+        Words of the vocabulary within the given distance from word.
+        :param word: the query word
+        :param distance: max edit distance, at most MAX_DISTANCE
+        :return: list of (distance, word) sorted by distance
+        """
+        distance = min(distance, self.MAX_DISTANCE)
+
+        candidates = set()
+        for delete in _deletes(word, distance):
+            candidates.update(self._deletes.get(delete, ()))
+
+        found = []
+        for candidate in candidates:
+            d = damerau_levenshtein(word, candidate, limit=distance)
+            if d <= distance:
+                found.append((d, candidate))
+        return sorted(found)
+
+    def __len__(self):
+        return self._size
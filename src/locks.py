@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+import uuid
+from typing import Optional
+
+from const import DbType
+from env import REDIS_HOST
+
+try:
+    import redis
+except ImportError:
+    # Installed with the Redis broker of Celery, optional otherwise
+    redis = None
+
+# Setup logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Seconds after which a lock held by a dead update expires
+LOCK_TTL = 3600
+LOCK_KEY = "rcbot:update-lock:{schema}"
+
+# Deletes/extends the key only if it still holds our token
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+_REFRESH_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class UpdateLock:
+    """
+    One update at a time per schema, whoever triggers it: /update,
+    Celery beat or the updater CLI. Backed by the Redis of the Celery
+    broker, so it holds across processes, with an in-process fallback
+    when Redis is not available. Locks expire after "ttl" seconds,
+    so a crashed update does not block the next ones.
+
+    Example:
+        token = update_lock.acquire(DbType.MALE)
+        if token is None:
+            ...  # joined the running update
+        update_lock.release(DbType.MALE, token)
+    """
+
+    def __init__(self, client=None, ttl: int = LOCK_TTL):
+        self.ttl = ttl
+        self._client = client
+        self._local: dict[str, tuple[str, float]] = {}
+        self._local_lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url: Optional[str], ttl: int = LOCK_TTL) -> "UpdateLock":
+        if redis is None or not url:
+            logger.warning("LOCKS - Redis not configured, update locks are per process")
+            return cls(None, ttl)
+        return cls(redis.Redis.from_url(url), ttl)
+
+    def acquire(self, schema_name: DbType) -> Optional[str]:
+        """
+        Try to take the lock of a schema.
+        :param schema_name: Either DBType.MALE or DBType.FEMALE
+        :return: the token to release the lock, None if an update is already running
+        """
+        key = LOCK_KEY.format(schema=DbType(schema_name).value)
+        token = uuid.uuid4().hex
+        if self._client is not None:
+            try:
+                return token if self._client.set(key, token, nx=True, ex=self.ttl) else None
+            except redis.RedisError as e:
+                logger.warning(f"LOCKS - Redis unavailable [{e}], using the in-process lock")
+
+        with self._local_lock:
+            holder = self._local.get(key)
+            if holder is not None and holder[1] > time.monotonic():
+                return None
+            self._local[key] = (token, time.monotonic() + self.ttl)
+            return token
+
+    def refresh(self, schema_name: DbType, token: str) -> bool:
+        """
+        Extend the lock of a running update for another "ttl" seconds.
+        :return: False if the lock is not held by token anymore
+        """
+        key = LOCK_KEY.format(schema=DbType(schema_name).value)
+        if self._client is not None:
+            try:
+                return bool(self._client.eval(_REFRESH_SCRIPT, 1, key, token, self.ttl))
+            except redis.RedisError as e:
+                logger.warning(f"LOCKS - Redis unavailable [{e}], using the in-process lock")
+
+        with self._local_lock:
+            holder = self._local.get(key)
+            if holder is None or holder[0] != token:
+                return False
+            self._local[key] = (token, time.monotonic() + self.ttl)
+            return True
+
+    def release(self, schema_name: DbType, token: Optional[str]) -> None:
+        if token is None:
+            return
+        key = LOCK_KEY.format(schema=DbType(schema_name).value)
+        if self._client is not None:
+            try:
+                self._client.eval(_RELEASE_SCRIPT, 1, key, token)
+                return
+            except redis.RedisError as e:
+                logger.warning(f"LOCKS - Redis unavailable [{e}], using the in-process lock")
+
+        with self._local_lock:
+            holder = self._local.get(key)
+            if holder is not None and holder[0] == token:
+                del self._local[key]
+
+    def is_locked(self, schema_name: DbType) -> bool:
+        key = LOCK_KEY.format(schema=DbType(schema_name).value)
+        if self._client is not None:
+            try:
+                return bool(self._client.exists(key))
+            except redis.RedisError as e:
+                logger.warning(f"LOCKS - Redis unavailable [{e}], using the in-process lock")
+
+        with self._local_lock:
+            holder = self._local.get(key)
+            return holder is not None and holder[1] > time.monotonic()
+
+
+update_lock = UpdateLock.from_url(REDIS_HOST)
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+
 class Monologue:
+    """
+    Record of a monologue, meant to be read only.
+    Slotted, with the hash computed once, since they
+    end up in sets and dicts while searching.
+    """
+
+    __slots__ = ("text", "url", "_hash")
 
-    text: str = ""
-    url: str = ""
+    text: str
+    url: str
 
     def __init__(self, text, url):
         self.text = text
         self.url = url
+        self._hash = hash((text, url))
 
     @classmethod
     def from_dict(cls, monologue: dict) -> Monologue:
@@ -17,10 +26,12 @@ class Monologue:
         return {"text": self.text, "url": self.url}
 
     def __eq__(self, __value):
-        return __value.text == self.text and __value.url == self.url
+        if not isinstance(__value, Monologue):
+            return NotImplemented
+        return self._hash == __value._hash and __value.text == self.text and __value.url == self.url
 
     def __repr__(self):
         return "Item(%s, %s)" % (self.text, self.url)
 
     def __hash__(self):
-        return hash(self.__repr__())
\ No newline at end of file
+        return self._hash
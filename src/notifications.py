@@ -0,0 +1,81 @@
+import logging
+from typing import Optional
+
+from env import REDIS_HOST
+
+try:
+    import redis
+except ImportError:
+    # Installed with the Redis broker of Celery, optional otherwise
+    redis = None
+
+# Setup logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Channel where the updater announces the new database generation
+DATABASE_CHANNEL = "rcbot:database-updated"
+
+
+def _client():
+    if redis is None or not REDIS_HOST:
+        return None
+    return redis.Redis.from_url(REDIS_HOST)
+
+
+def publish_database_update(generation: int) -> None:
+    """
+    Tell the bot processes that a new database generation has been committed.
+    Best effort: without Redis the bot notices the change by polling.
+    :param generation: the committed generation
+    """
+    client = _client()
+    if client is None:
+        return
+    try:
+        client.publish(DATABASE_CHANNEL, generation)
+    except redis.RedisError as e:
+        logger.warning(f"NOTIFICATIONS - Could not publish generation [{generation}]: [{e}]")
+
+
+def subscribe_database_updates():
+    """
+    Subscribe to the database updates.
+    :return: a Redis PubSub, None if Redis is not available
+    """
+    client = _client()
+    if client is None:
+        return None
+    try:
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(DATABASE_CHANNEL)
+        return pubsub
+    except redis.RedisError as e:
+        logger.warning(f"NOTIFICATIONS - Could not subscribe to database updates: [{e}]")
+        return None
+
+
+def close_subscription(pubsub) -> None:
+    """
+    Close a subscription, best effort: it may be broken already.
+    :param pubsub: the subscription, see "subscribe_database_updates"
+    """
+    try:
+        pubsub.close()
+    except redis.RedisError as e:
+        logger.warning(f"NOTIFICATIONS - Could not close the subscription: [{e}]")
+
+
+def wait_database_update(pubsub, timeout: float) -> Optional[int]:
+    """
+    Wait for the next database update.
+    :param pubsub: the subscription, see "subscribe_database_updates"
+    :param timeout: max seconds to wait
+    :return: the announced generation, None on timeout
+    """
+    message = pubsub.get_message(timeout=timeout)
+    if message is None:
+        return None
+    return int(message["data"])
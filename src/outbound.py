@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, Callable, Coroutine, Optional, Union
+
+from telegram.constants import FloodLimit
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Setup logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Attempts of a request refused by the flood control before giving up
+MAX_RETRIES = 3
+# Buckets of idle chats are dropped when there are more than these
+MAX_CHAT_BUCKETS = 1024
+# Requests a private chat may send in a burst before being throttled
+CHAT_BURST = 3
+
+
+class TokenBucket:
+    """
+    Token bucket for the asyncio loop: "rate" requests per second,
+    up to "capacity" in a burst. Waiting requests reserve their token
+    in order, so they are served first come first served.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        self._refill()
+        # Tokens may go negative, the debt is the wait of the next requests
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class OutboundRateLimiter(BaseRateLimiter[int]):
+    """
+    Smooths the requests of the bot to the limits of Telegram instead of
+    failing them: a bucket per chat, one message per second in private
+    chats and 20 per minute in groups, and a global one of 30 per second.
+    Only requests addressed to a chat are throttled, answers to callback
+    and inline queries go straight through.
+
+    A request refused anyway with RetryAfter holds all the requests for
+    the time asked by Telegram and is retried, up to MAX_RETRIES times.
+
+    Example:
+        ApplicationBuilder().token(BOT_TOKEN).rate_limiter(OutboundRateLimiter()).build()
+    """
+
+    def __init__(self, global_rate: float = FloodLimit.MESSAGES_PER_SECOND,
+                 chat_rate: float = FloodLimit.MESSAGES_PER_SECOND_PER_CHAT,
+                 group_rate: float = FloodLimit.MESSAGES_PER_MINUTE_PER_GROUP / 60,
+                 max_retries: int = MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[Union[int, str], TokenBucket] = {}
+        # Monotonic time until which the flood control asks to wait, the
+        # latest of the RetryAfter received, overlapping waits end with the last
+        self._held_until = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.is_full()}
+            # Groups and channels have negative ids, or a @username
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, FloodLimit.MESSAGES_PER_MINUTE_PER_GROUP)
+            else:
+                bucket = TokenBucket(self.chat_rate, CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_release(self) -> None:
+        # The deadline may be pushed further by a RetryAfter received meanwhile
+        delay = self._held_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._held_until - time.monotonic()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, dict, list[dict]]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, dict, list[dict]]:
+        """
+        :param rate_limit_args: max retries of this request, MAX_RETRIES by default
+        """
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            try:
+                chat_id = int(chat_id)
+            except (TypeError, ValueError):
+                pass
+            await self._chat_bucket(chat_id).acquire()
+            await self._global.acquire()
+
+        for attempt in range(max_retries + 1):
+            await self._wait_release()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    logger.error(f"OUTBOUND - [{endpoint}] still flooded after {max_retries} retries")
+                    raise
+                delay = e.retry_after
+                if isinstance(delay, datetime.timedelta):
+                    delay = delay.total_seconds()
+                logger.warning(f"OUTBOUND - Flood control on [{endpoint}], holding requests for {delay}s")
+                self._held_until = max(self._held_until, time.monotonic() + delay + 0.1)
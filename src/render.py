@@ -0,0 +1,39 @@
+import html
+from typing import Iterable
+
+# Telegram API has a limit of 4096 in message size. Pages are measured
+# in UTF-8 bytes, never fewer than the characters Telegram counts
+MESSAGE_LIMIT = 4096
+
+
+def monologue_fragment(text: str, url: str) -> str:
+    """
+    HTML of a monologue in the search answers, title and url escaped.
+    Titles come from the blog and may contain "<" or "&".
+    """
+    text = html.escape(text)
+    url = html.escape(url)
+    return f"<b>Nome:</b> {text}\n<b>Url:</b> <a href=\"{url}\">{url}</a>\n"
+
+
+def paginate(header: str, fragments: Iterable[tuple[str, int]], limit: int = MESSAGE_LIMIT) -> tuple[str, ...]:
+    """
+    Pack the fragments in as few messages as possible, in order, without
+    splitting a fragment. The header opens the first page.
+    :param header: HTML at the top of the first page, may be empty
+    :param fragments: the HTML of the results and its size in bytes, best first
+    :param limit: max size of a page in bytes
+    :return: the pages, at least one
+    """
+    pages = []
+    page = [header] if header else []
+    size = len(header.encode())
+    for fragment, length in fragments:
+        if page and size + length > limit:
+            pages.append("".join(page))
+            page, size = [], 0
+        page.append(fragment)
+        size += length
+    if page or not pages:
+        pages.append("".join(page))
+    return tuple(pages)
@@ -1,29 +1,251 @@
+import atexit
 import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Optional
+
+from env import REDIS_HOST, ROLES_BACKEND
+
+try:
+    import redis
+except ImportError:
+    # Installed with the Redis broker of Celery, optional otherwise
+    redis = None
+
+# Setup logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
 
 ROLES_FILE = "roles.json"
+ROLES_DATABASE_FILE = "database.db"
+ROLES_KEY = "rcbot:roles"
+
+ROLE_USER = "user"
+ROLE_ADMIN = "admin"
+ROLE_CREATOR = "creator"
+ROLE_BANNED = "banned"
+
+# Seconds the changes are collected before being written together
+FLUSH_DELAY = 1.0
+
+
+class JsonRoleBackend:
+    """
+    Roles in a JSON file, rewritten whole on a temporary file then
+    renamed over the old one, so a crash never leaves it half written.
+    """
+
+    def __init__(self, path: str = ROLES_FILE):
+        self.path = path
+
+    def load(self) -> dict[str, str]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, roles: dict[str, str], changes: dict[str, str]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".roles-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(roles, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+class SqliteRoleBackend:
+    """
+    Roles in a table of the SQLite database, only the changes are written,
+    in one transaction.
+    """
+
+    def __init__(self, path: str = ROLES_DATABASE_FILE):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS roles (user_id TEXT PRIMARY KEY, role TEXT NOT NULL)")
+
+    def load(self) -> dict[str, str]:
+        return dict(self._connection.execute("SELECT user_id, role FROM roles").fetchall())
+
+    def save(self, roles: dict[str, str], changes: dict[str, str]) -> None:
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._connection.executemany(
+                "INSERT INTO roles (user_id, role) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET role = excluded.role",
+                changes.items())
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+
+class RedisRoleBackend:
+    """
+    Roles in a hash of the Redis of the Celery broker, only the changes
+    are written, with a single HSET.
+    """
+
+    def __init__(self, url: str = REDIS_HOST):
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def load(self) -> dict[str, str]:
+        return self._client.hgetall(ROLES_KEY)
+
+    def save(self, roles: dict[str, str], changes: dict[str, str]) -> None:
+        self._client.hset(ROLES_KEY, mapping=changes)
+
+
+class RoleService:
+    """
+    Roles of the users, read from memory in O(1) and persisted in background.
+
+    Changes are applied to memory at once and collected for FLUSH_DELAY
+    seconds, then written together by a background thread, so the handlers
+    never wait for the disk. Pending changes are also written at exit.
+    The roles are read once by "load", at startup, before serving updates.
+
+    Example:
+        role_service = RoleService(SqliteRoleBackend(), seed=JsonRoleBackend())
+        role_service.load()
+        role_service.set_role(user_id, ROLE_BANNED)
+        role_service.is_banned(user_id)
+    """
+
+    def __init__(self, backend, flush_delay: float = FLUSH_DELAY, seed=None):
+        """
+        :param backend: where the roles are kept
+        :param flush_delay: seconds the changes are collected before being written
+        :param seed: backend the roles are imported from when "backend" is empty, optional
+        """
+        self.backend = backend
+        self.flush_delay = flush_delay
+        self.seed = seed
+        self._roles: Optional[dict[str, str]] = None
+        self._pending: dict[str, str] = {}
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        # Flushes run one at a time, so the writes keep the order of the changes
+        self._flush_lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Read the roles from the backend, if not done yet. An empty backend is
+        filled from "seed" first. If the backend cannot be read the error is
+        logged and the service starts with no roles, it is not retried.
+        """
+        if self._roles is not None:
+            return
+        try:
+            roles = self.backend.load()
+        except Exception as e:
+            logger.error(f"ROLES - Could not load the roles [{e}], starting with none")
+            roles = {}
+        else:
+            if not roles and self.seed is not None:
+                roles = self._import_seed()
+        with self._lock:
+            if self._roles is None:
+                self._roles = roles
+        logger.info(f"ROLES - Loaded [{len(self._roles)}] roles")
+
+    def _import_seed(self) -> dict[str, str]:
+        try:
+            roles = self.seed.load()
+        except Exception as e:
+            logger.error(f"ROLES - Could not import the roles [{e}]")
+            return {}
+        if not roles:
+            return roles
+        try:
+            self.backend.save(roles, roles)
+            logger.info(f"ROLES - Imported [{len(roles)}] roles into the new backend")
+        except Exception as e:
+            # Kept in memory, written with the next changes
+            logger.error(f"ROLES - Could not save the imported roles [{e}]")
+            with self._lock:
+                self._pending = {**roles, **self._pending}
+        return roles
+
+    def _get_roles(self) -> dict[str, str]:
+        # Loaded at startup, read here only by the tools that skip it
+        if self._roles is None:
+            self.load()
+        return self._roles
+
+    def get_role(self, user_id) -> str:
+        return self._get_roles().get(str(user_id), ROLE_USER)
+
+    def set_role(self, user_id, role: str) -> None:
+        roles = self._get_roles()
+        with self._lock:
+            roles[str(user_id)] = role
+            self._pending[str(user_id)] = role
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        """
+        Write the pending changes now. Failed writes are retried with the next changes.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._timer = None
+                if not self._pending:
+                    return
+                changes, self._pending = self._pending, {}
+                roles = dict(self._roles)
+            try:
+                self.backend.save(roles, changes)
+            except Exception as e:
+                logger.error(f"ROLES - Could not save [{len(changes)}] role changes [{e}]")
+                with self._lock:
+                    self._pending = {**changes, **self._pending}
+                return
+            logger.info(f"ROLES - Saved [{len(changes)}] role changes")
+
+    def is_creator(self, user_id) -> bool:
+        return self.get_role(user_id) == ROLE_CREATOR
 
-def load_roles():
-    try:
-        with open(ROLES_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    def is_admin_or_creator(self, user_id) -> bool:
+        return self.get_role(user_id) in (ROLE_ADMIN, ROLE_CREATOR)
 
-def save_roles(roles):
-    with open(ROLES_FILE, "w") as f:
-        json.dump(roles, f)
+    def is_banned(self, user_id) -> bool:
+        return self.get_role(user_id) == ROLE_BANNED
 
-user_roles = load_roles()
 
-def get_role(user_id):
-    return user_roles.get(str(user_id), "user")
+def _role_service() -> RoleService:
+    if ROLES_BACKEND == "sqlite":
+        backend = SqliteRoleBackend()
+    elif ROLES_BACKEND == "redis" and redis is not None and REDIS_HOST:
+        backend = RedisRoleBackend()
+    else:
+        if ROLES_BACKEND == "redis":
+            logger.warning("ROLES - Redis not configured, roles are kept in the JSON file")
+        return RoleService(JsonRoleBackend())
+    # The roles of the previous versions are in the JSON file, imported on first start
+    return RoleService(backend, seed=JsonRoleBackend())
 
-def set_role(user_id, role):
-    user_roles[str(user_id)] = role
-    save_roles(user_roles)
 
-def is_creator(user_id):
-    return get_role(user_id) == "creator"
+role_service = _role_service()
+atexit.register(role_service.flush)
 
-def is_admin_or_creator(user_id):
-    return get_role(user_id) in ["admin", "creator"]
+get_role = role_service.get_role
+set_role = role_service.set_role
+is_creator = role_service.is_creator
+is_admin_or_creator = role_service.is_admin_or_creator
+is_banned = role_service.is_banned
@@ -1,9 +1,67 @@
 import logging
+import threading
 import time
+from dataclasses import dataclass
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.remote.webdriver import WebElement, WebDriver
+from selenium.webdriver.remote.webdriver import WebDriver
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
 from selenium import webdriver
-from typing import Any
+from typing import Any, Optional
+
+from env import REDIS_HOST, SCRAPER_MIN_INTERVAL
+
+try:
+    import redis
+except ImportError:
+    # Installed with the Redis broker of Celery, optional otherwise
+    redis = None
+
+# Class names of the RC blog links
+POST_LINK_CLASS = "BlogPostAnnounceHeaderLinkUi"
+PAGINATION_LINK_CLASS = "PaginationLinkUi"
+
+HTTP_TIMEOUT = 15
+
+# Tags of an article page that are not part of the article text
+ARTICLE_NOISE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "form", "aside"]
+
+# Collects in the browser the links whose class contains arguments[0]
+# as [class, href, text] rows, one round-trip instead of three per link
+LINKS_SCRIPT = """
+const rows = [];
+for (const a of document.getElementsByTagName("a")) {
+    const cls = a.getAttribute("class") || "";
+    if (cls.includes(arguments[0])) {
+        rows.push([cls, a.href || "", (a.innerText || "").trim()]);
+    }
+}
+return rows;
+"""
+
+# Key held for "min_interval" after a request to a host, in the Redis of the
+# Celery broker, so the scraping tasks of all the workers share the limit
+SLOT_KEY = "rcbot:scraper-slot:{host}"
+
+# Chrome is restarted after this many pages to bound its memory
+MAX_PAGES_PER_DRIVER = 20
+
+# Hard limit in seconds to load and scroll a page with Chrome
+PAGE_TIMEOUT = 30
+# Max scrolls to load lazy content of a page
+MAX_SCROLLS = 10
+# First and max delay in seconds between checks for new content after a scroll
+SCROLL_POLL_DELAY = 0.1
+SCROLL_POLL_MAX_DELAY = 0.8
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) rc-bot",
+    "Accept-Language": "it-IT,it;q=0.9",
+}
 
 # Setup logging
 logging.basicConfig(
@@ -26,6 +84,331 @@ def _get_driver() -> WebDriver:
     # instantiate Chrome WebDriver with options
     return webdriver.Chrome(options=options)
 
+class RateLimiter:
+    """
+    Politeness limit shared by the scrapers: requests to the same host
+    are spaced by at least "min_interval" seconds.
+
+    The threads of a process queue for the slots in memory. With Redis
+    the slot is then taken there too, a key set with NX that expires after
+    "min_interval", so the page tasks of all the Celery workers share the
+    limit. Without Redis, or when it fails, the limit is per process.
+
+    Example:
+        rate_limiter = RateLimiter.from_url(SCRAPER_MIN_INTERVAL, REDIS_HOST)
+        rate_limiter.wait(url)
+    """
+
+    def __init__(self, min_interval: float, client=None):
+        self.min_interval = min_interval
+        self._client = client
+        self._next_slot: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, min_interval: float, url: Optional[str]) -> "RateLimiter":
+        if redis is None or not url:
+            logger.warning("SCRAPER - Redis not configured, the rate limit is per process")
+            return cls(min_interval)
+        return cls(min_interval, redis.Redis.from_url(url))
+
+    def wait(self, url: str) -> None:
+        """
+        Block until a request to the host of url is allowed.
+        :param url: the url about to be requested
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+        if self._client is not None and self.min_interval > 0:
+            try:
+                self._wait_shared(host)
+            except redis.RedisError as e:
+                logger.warning(f"SCRAPER - Redis unavailable [{e}], using the in-process rate limit")
+
+    def _wait_shared(self, host: str) -> None:
+        key = SLOT_KEY.format(host=host)
+        interval = max(1, round(self.min_interval * 1000))
+        # Whoever finds the key waits for it to expire and tries again
+        while not self._client.set(key, 1, nx=True, px=interval):
+            time.sleep(max(self._client.pttl(key), 1) / 1000)
+
+
+rate_limiter = RateLimiter.from_url(SCRAPER_MIN_INTERVAL, REDIS_HOST)
+
+
+@dataclass
+class PageTiming:
+    """
+    Seconds spent on a scraped page, split by phase.
+    """
+    url: str
+    engine: str = "chrome"
+    load: float = 0.0
+    wait: float = 0.0
+    extract: float = 0.0
+    scrolls: int = 0
+
+    @property
+    def total(self) -> float:
+        return self.load + self.wait + self.extract
+
+
+class DriverSession:
+    """
+    Headless Chrome shared by all the scrapes of an update run.
+    The browser is started on first use, so a run served by plain
+    HTTP never starts it. It is restarted when it stops answering
+    or after "max_pages" pages.
+    Scraping threads share the browser holding "lock" for a whole page.
+
+    Example:
+        with DriverSession() as session:
+            chrome_monologue_scraper(url, session=session)
+    """
+
+    def __init__(self, max_pages: int = MAX_PAGES_PER_DRIVER):
+        self.max_pages = max_pages
+        self._driver: Optional[WebDriver] = None
+        self._pages = 0
+        self.timings: list[PageTiming] = []
+        self.lock = threading.RLock()
+
+    def get(self) -> WebDriver:
+        """
+        A healthy driver for the next page.
+        :return: WebDriver instance
+        """
+        if self._driver is not None and (self._pages >= self.max_pages or not self._healthy()):
+            logger.info(f"SCRAPER - Recycling Chrome after [{self._pages}] pages")
+            self.close()
+
+        if self._driver is None:
+            self._driver = _get_driver()
+            self._pages = 0
+
+        self._pages += 1
+        return self._driver
+
+    def _healthy(self) -> bool:
+        try:
+            return self._driver.execute_script("return 1") == 1
+        except WebDriverException:
+            return False
+
+    def record(self, timing: PageTiming) -> None:
+        logger.info(f"SCRAPER - [{timing.url}] via {timing.engine} in {timing.total:.2f}s "
+                    f"(load {timing.load:.2f}s, wait {timing.wait:.2f}s, "
+                    f"extract {timing.extract:.2f}s, scrolls {timing.scrolls})")
+        self.timings.append(timing)
+
+    def log_timings(self) -> None:
+        """
+        Log how the time of the run has been spent.
+        """
+        if not self.timings:
+            return
+        total = sum(t.total for t in self.timings)
+        wait = sum(t.wait for t in self.timings)
+        logger.info(f"SCRAPER - Scraped [{len(self.timings)}] pages in {total:.2f}s, "
+                    f"{wait:.2f}s waiting for the pages to load")
+
+    def close(self) -> None:
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except WebDriverException as e:
+                logger.warning(f"SCRAPER - Chrome did not quit cleanly [{e}]")
+            self._driver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _wait_page_loaded(driver: WebDriver, link_class: str, timing: PageTiming, deadline: float) -> None:
+    """
+    Wait for the links of the page, then scroll to load the lazy content.
+    After each scroll the page is polled with an exponential back-off
+    until the height or the number of links changes. Scrolling stops when
+    nothing changes, after MAX_SCROLLS scrolls or at the deadline.
+    :param driver: Selenium webdriver
+    :param link_class: class of the links to wait for
+    :param timing: timing of the page, wait and scrolls are updated
+    :param deadline: time.monotonic() value not to exceed
+    """
+    start = time.monotonic()
+    selector = f'a[class*="{link_class}"]'
+    state_script = f"return [document.body.scrollHeight, document.querySelectorAll('{selector}').length];"
+
+    try:
+        WebDriverWait(driver, max(deadline - start, 0)).until(
+            expected_conditions.presence_of_element_located((By.CSS_SELECTOR, selector)))
+    except TimeoutException:
+        logger.warning(f"SCRAPER - No [{link_class}] links after {PAGE_TIMEOUT}s")
+        timing.wait += time.monotonic() - start
+        return
+
+    last_state = driver.execute_script(state_script)
+    while timing.scrolls < MAX_SCROLLS:
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        timing.scrolls += 1
+
+        changed = False
+        delay = SCROLL_POLL_DELAY
+        while delay <= SCROLL_POLL_MAX_DELAY and time.monotonic() + delay < deadline:
+            time.sleep(delay)
+            state = driver.execute_script(state_script)
+            if state != last_state:
+                last_state = state
+                changed = True
+                break
+            delay *= 2
+
+        if not changed:
+            break
+
+    timing.wait += time.monotonic() - start
+
+
+def fetch_page(url: str, session: Optional[requests.Session] = None) -> str:
+    """
+    Download the HTML of a page of the RC blog.
+    :param url: the page url
+    :param session: requests session to reuse connections, optional
+    :return: the HTML of the page
+    """
+    rate_limiter.wait(url)
+    response = (session or requests).get(url, headers=HTTP_HEADERS, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    response.encoding = response.encoding or "utf-8"
+    return response.text
+
+
+def fetch_if_modified(url: str, etag: Optional[str] = None,
+                      last_modified: Optional[str] = None) -> Optional[requests.Response]:
+    """
+    Conditional download of a page of the RC blog.
+    :param url: the page url
+    :param etag: ETag header of the last download, optional
+    :param last_modified: Last-Modified header of the last download, optional
+    :return: the response, None if the page has not changed
+    """
+    headers = dict(HTTP_HEADERS)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    rate_limiter.wait(url)
+    response = requests.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    response.encoding = response.encoding or "utf-8"
+    return response
+
+
+def _has_class(tag, class_name: str) -> bool:
+    # Same check of the WebDriver scraper, class names are generated
+    # with a suffix so a substring is looked for
+    return class_name in " ".join(tag.get("class", []))
+
+
+def parse_monologue_links(html: str, base_url: str = "") -> list[dict[str, Any]]:
+    """
+    Creates monologues entries from the HTML of a page of the RC blog.
+    Same entries of "_monologue_scraper", without a browser.
+    :param html: the HTML of the page
+    :param base_url: url of the page, to resolve relative links
+    :return: list of dicts with "url" and "text"
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    scraped_data = []
+    for blog_post in soup.find_all("a", href=True):
+        if not _has_class(blog_post, POST_LINK_CLASS):
+            continue
+
+        # avoid to grab links with no title
+        blog_post_name = " ".join(blog_post.get_text(" ").split())
+        if blog_post_name == "":
+            continue
+
+        scraped_data.append({
+            "url": urljoin(base_url, blog_post["href"]),
+            "text": blog_post_name,
+        })
+    return scraped_data
+
+
+def parse_article_body(html: str) -> str:
+    """
+    Extract the text of an article of the RC blog, the monologue itself.
+    :param html: the HTML of the article page
+    :return: the text, one line per paragraph
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup.find_all(ARTICLE_NOISE_TAGS):
+        tag.decompose()
+    article = soup.find("article") or soup.body or soup
+    lines = (" ".join(line.split()) for line in article.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def fetch_article_body(url: str, session: Optional[requests.Session] = None) -> Optional[str]:
+    """
+    Download the text of an article of the RC blog.
+    :param url: the article url
+    :param session: requests session to reuse connections, optional
+    :return: the text, empty if the article is gone, None if it could not be downloaded
+    """
+    try:
+        return parse_article_body(fetch_page(url, session))
+    except requests.HTTPError as e:
+        # Removed or forbidden article, retrying would not help
+        if e.response is not None and 400 <= e.response.status_code < 500:
+            logger.warning(f"SCRAPER - Article [{url}] not available: [{e}]")
+            return ""
+        logger.warning(f"SCRAPER - Could not download article [{url}]: [{e}]")
+    except requests.RequestException as e:
+        logger.warning(f"SCRAPER - Could not download article [{url}]: [{e}]")
+    return None
+
+
+def parse_pagination_counter(html: str) -> Optional[int]:
+    """
+    Extract the total number of pages from the HTML of a page of the RC blog.
+    :param html: the HTML of the page
+    :return: the number of pages, None if the pagination is not found
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    pages = []
+    for tag in soup.find_all("a"):
+        if _has_class(tag, PAGINATION_LINK_CLASS):
+            text = tag.get_text(strip=True)
+            if text.isdigit():
+                pages.append(int(text))
+    return max(pages) if pages else None
+
+
+def _extract_links(driver: WebDriver, link_class: str) -> list[tuple[str, str, str]]:
+    """
+    Links of the page whose class contains link_class,
+    extracted with a single script call.
+    :param driver: Selenium webdriver
+    :param link_class: class of the links to extract
+    :return: list of (class, href, text)
+    """
+    return [tuple(row) for row in driver.execute_script(LINKS_SCRIPT, link_class)]
+
+
 def _extract_pagination_counter(driver) -> int:
     """
     Extract pagination counter e.g the total number of pages.
@@ -34,48 +417,94 @@ def _extract_pagination_counter(driver) -> int:
     :param driver: Selenium webdriver
     :return: the number of pages of RC blog for monologues
     """
-    tags: list[WebElement] = driver.find_elements(By.TAG_NAME, "a")
     pages = []
-    for tag in tags:
-        if "PaginationLinkUi" in tag.get_attribute("class"):
-            text = tag.text
-            if text is not None and text != "":
-                pages.append(text)
-    return max([int(p) for p in pages])
+    for _, _, text in _extract_links(driver, PAGINATION_LINK_CLASS):
+        if text.isdigit():
+            pages.append(int(text))
+    return max(pages)
 
 
-def get_total_pagination_counter(url: str) -> int:
+@dataclass
+class FirstPage:
     """
-    Returns the total number of pages of the blog for monologues.
-    :param driver: Selenium webdriver
+    Newest page of a blog category, with the validators
+    to download it again only if it changes.
+    """
+    blog_posts: list[dict[str, Any]]
+    total_pages: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def probe_first_page(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                     session: Optional[DriverSession] = None) -> Optional[FirstPage]:
+    """
+    Scrape monologues and pagination counter of the newest page with one
+    conditional request. Headless Chrome is used only if the plain HTML
+    has no monologues.
+    :param url: the url of the first page of the blog category
+    :param etag: ETag of the last probe, optional
+    :param last_modified: Last-Modified of the last probe, optional
+    :param session: Chrome session to reuse for the fallback, optional
+    :return: the first page, None if it has not changed since the last probe
+    """
+    try:
+        response = fetch_if_modified(url, etag, last_modified)
+        if response is None:
+            logger.info(f"SCRAPER - [{url}] not modified")
+            return None
+
+        blog_posts = parse_monologue_links(response.text, base_url=url)
+        if blog_posts:
+            # No pagination links when the category fits in a page
+            total_pages = parse_pagination_counter(response.text) or 1
+            return FirstPage(blog_posts, total_pages,
+                             etag=response.headers.get("ETag"),
+                             last_modified=response.headers.get("Last-Modified"))
+        logger.warning(f"SCRAPER - No monologues in HTML of [{url}], falling back to Chrome")
+    except requests.RequestException as e:
+        logger.warning(f"SCRAPER - Fetching [{url}] failed [{e}], falling back to Chrome")
+
+    return FirstPage(chrome_monologue_scraper(url, session=session),
+                     chrome_pagination_counter(url, session=session))
+
+
+def chrome_pagination_counter(url: str, session: Optional[DriverSession] = None) -> int:
+    """
+    Returns the total number of pages of the blog for monologues
+    rendering the page with headless Chrome.
+    :param url: the url of the first page of the blog category
+    :param session: Chrome session to reuse, a new browser is started otherwise
     :return: total number of pages
     """
+    if session is None:
+        with DriverSession() as session:
+            return chrome_pagination_counter(url, session=session)
+
+    # the browser serves one page at a time
+    with session.lock:
+        return _chrome_pagination_counter(url, session)
+
+
+def _chrome_pagination_counter(url: str, session: DriverSession) -> int:
+    driver = session.get()
+    timing = PageTiming(url)
 
-    driver = _get_driver()
     # open the specified URL in the browser
+    rate_limiter.wait(url)
+    start = time.monotonic()
     driver.get(url)
+    timing.load = time.monotonic() - start
 
-    # get the previous height value
-    last_height = driver.execute_script("return document.body.scrollHeight")
     logger.info("SCRAPER - Waiting page to be loaded")
-    while True:
-        # scroll down to the bottom
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-
-        # wait for the page to load
-        time.sleep(2)
+    _wait_page_loaded(driver, PAGINATION_LINK_CLASS, timing, deadline=start + PAGE_TIMEOUT)
 
-        # get the new height and compare it with the last height
-        new_height = driver.execute_script("return document.body.scrollHeight")
+    # extract data once all content has loaded
+    start = time.monotonic()
+    total_pages = _extract_pagination_counter(driver)
+    timing.extract = time.monotonic() - start
 
-        if new_height == last_height:
-            # extract data once all content has loaded
-            total_pages = _extract_pagination_counter(driver)
-            break
-        last_height = new_height
-
-    # close the browser
-    driver.quit()
+    session.record(timing)
     return total_pages
 
 
@@ -88,78 +517,90 @@ def _monologue_scraper(driver) -> list[dict[str, Any]]:
     :param driver: Selenium webdriver
     :return: list of dicts
     """
-    # find monologues using tag "a"
-    tags = driver.find_elements(By.TAG_NAME, "a")
     scraped_data = []
 
-    # iterate over found elements
-    for blog_post in tags:
+    # only monologue posts links are extracted
+    for _, blog_post_url, blog_post_name in _extract_links(driver, POST_LINK_CLASS):
 
         # avoid to grab links with no title
-        if blog_post.text is None or blog_post.text == "":
-            continue
-
-        # avoid to grab bad links, only monologue posts should be taken
-        if "BlogPostAnnounceHeaderLinkUi" not in blog_post.get_attribute("class"):
+        if blog_post_name == "":
             continue
 
-        blog_post_url = blog_post.get_attribute("href")
-        blog_post_name = blog_post.text
-
-        data = {
+        scraped_data.append({
             "url": blog_post_url,
             "text": blog_post_name,
-        }
-
-        # append the data to the empty list
-        scraped_data.append(data)
+        })
 
     # return the scraped data
     return scraped_data
 
 
-def async_monologue_scraper(url: str) -> list[Any]:
-
+def async_monologue_scraper(url: str, session: Optional[DriverSession] = None) -> list[Any]:
+    """
+    Scrape the monologues of a page of the RC blog.
+    The plain HTML of the page is parsed, headless Chrome is started
+    only if no monologue is found there.
+    :param url: the page url
+    :param session: Chrome session to reuse for the fallback, optional
+    :return: list of dicts with "url" and "text"
+    """
     logger.info(f"SCRAPER - Starting scraper at url [{url}]")
+    try:
+        timing = PageTiming(url, engine="http")
+        start = time.monotonic()
+        html = fetch_page(url)
+        timing.load = time.monotonic() - start
+
+        start = time.monotonic()
+        blog_monologue_posts = parse_monologue_links(html, base_url=url)
+        timing.extract = time.monotonic() - start
+
+        if blog_monologue_posts:
+            if session is not None:
+                session.record(timing)
+            logger.info(f"SCRAPER - Scraping of [{url}] done")
+            return blog_monologue_posts
+        logger.warning(f"SCRAPER - No monologues in HTML of [{url}], falling back to Chrome")
+    except requests.RequestException as e:
+        logger.warning(f"SCRAPER - Fetching [{url}] failed [{e}], falling back to Chrome")
+    return chrome_monologue_scraper(url, session=session)
+
+
+def chrome_monologue_scraper(url: str, session: Optional[DriverSession] = None) -> list[Any]:
+    """
+    Scrape the monologues of a page of the RC blog rendering it with headless Chrome.
+    :param url: the page url
+    :param session: Chrome session to reuse, a new browser is started otherwise
+    :return: list of dicts with "url" and "text"
+    """
+    if session is None:
+        with DriverSession() as session:
+            return chrome_monologue_scraper(url, session=session)
 
-    # instantiate options for Chrome
-    options = webdriver.ChromeOptions()
+    # the browser serves one page at a time
+    with session.lock:
+        return _chrome_monologue_scraper(url, session)
 
-    # run the browser in headless mode
-    options.add_argument("--headless=new")
-    options.add_argument("--charset=utf-8")
 
-    # instantiate Chrome WebDriver with options
-    driver = webdriver.Chrome(options=options)
+def _chrome_monologue_scraper(url: str, session: DriverSession) -> list[Any]:
+    logger.info(f"SCRAPER - Starting Chrome scraper at url [{url}]")
+    driver = session.get()
+    timing = PageTiming(url)
 
     # open the specified URL in the browser
+    rate_limiter.wait(url)
+    start = time.monotonic()
     driver.get(url)
+    timing.load = time.monotonic() - start
 
-    # get the previous height value
-    last_height = driver.execute_script("return document.body.scrollHeight")
-
-    # array to collect scraped data
-    blog_monologue_posts = []
-
-    print("Waiting page to be loaded")
-    while True:
-        # scroll down to the bottom
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-
-        # wait for the page to load
-        time.sleep(2)
-
-        # get the new height and compare it with the last height
-        new_height = driver.execute_script("return document.body.scrollHeight")
-
-        if new_height == last_height:
-            # extract data once all content has loaded
-            blog_monologue_posts.extend(_monologue_scraper(driver))
+    logger.info("SCRAPER - Waiting page to be loaded")
+    _wait_page_loaded(driver, POST_LINK_CLASS, timing, deadline=start + PAGE_TIMEOUT)
 
-            break
-        last_height = new_height
+    # extract data once all content has loaded
+    start = time.monotonic()
+    blog_monologue_posts = _monologue_scraper(driver)
+    timing.extract = time.monotonic() - start
 
-    # close the browser
-    driver.quit()
+    session.record(timing)
     logger.info(f"SCRAPER - Scraping of [{url}] done")
     return blog_monologue_posts
@@ -1,25 +1,478 @@
-import json
+import copy
+import heapq
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Optional
 
 from const import DbType
+from env import INDEX_RELOAD_INTERVAL
+from fulltext import BodyIndex, tokenize
+from fuzzy import DeletionIndex, fold, max_distance
 from monologue import Monologue
+from notifications import close_subscription, subscribe_database_updates, wait_database_update
+from render import monologue_fragment
+from storage import MonologueStore
 
+# Longest n-gram kept in the index. Shorter keys are answered
+# straight from their posting list, longer ones by intersection
+NGRAM_SIZE = 3
 
-def search_monologue(schema_type: DbType, search_string: str = "") -> set[Monologue]:
+# Keywords starting with this prefix must all be in the title (AND),
+# the other ones are optional and only improve the rank (OR)
+REQUIRED_PREFIX = "+"
 
-    with open("database.json", "r") as db:
-        database = json.load(db)
-        database = database[str(schema_type.value)]
+_WORD = re.compile(r"\w+")
 
-    results = set()
+logger = logging.getLogger(__name__)
+
+
+def _ngrams(text: str, size: int) -> set[str]:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MonologueIndex:
+    """
+    Resident, read-only view of the monologues of one schema.
+    Built once from the database and shared by all the searches
+    until a newer database is published.
+
+    The catalogue is stored by columns, a tuple of titles and one of
+    urls, and Monologue records are created only for the results.
+
+    Titles are casefolded once and indexed by their n-grams up to
+    NGRAM_SIZE, so a substring lookup touches only the titles that
+    share all the n-grams of the key instead of scanning the schema.
+
+    The HTML fragments of the search answers are rendered and escaped
+    here too, so answering is a matter of joining them.
+
+    The accent folded words of the titles are also kept in a deletion
+    dictionary to answer typo tolerant lookups when the exact ones find nothing,
+    and sorted to answer the as-you-type lookups of the inline queries.
+
+    The article bodies, when downloaded, are searched by word in "bodies",
+    see fulltext.BodyIndex.
+    """
+
+    def __init__(self, texts: list[str], urls: list[str], bodies: Optional[BodyIndex] = None):
+        self.texts = tuple(texts)
+        self.urls = tuple(urls)
+        self.bodies = bodies if bodies is not None else BodyIndex()
+        self._positions = {url: position for position, url in enumerate(self.urls)}
+        self.titles = tuple(text.casefold() for text in self.texts)
+        self.words = tuple(frozenset(_WORD.findall(title)) for title in self.titles)
+
+        # Escaped HTML of the answers, rendered once instead of at every search
+        self.fragments = tuple(monologue_fragment(text, url) for text, url in zip(self.texts, self.urls))
+        self.fragment_sizes = tuple(len(fragment.encode()) for fragment in self.fragments)
+
+        postings = defaultdict(list)
+        for position, title in enumerate(self.titles):
+            grams = set()
+            for size in range(1, NGRAM_SIZE + 1):
+                grams.update(_ngrams(title, size))
+            for gram in grams:
+                postings[gram].append(position)
+        self._postings = dict(postings)
+
+        vocabulary = defaultdict(list)
+        for position, title in enumerate(self.titles):
+            for word in set(_WORD.findall(fold(title))):
+                vocabulary[word].append(position)
+        self._vocabulary = dict(vocabulary)
+        self._deletions = DeletionIndex(self._vocabulary)
+        # Sorted words of the titles, the words starting with a prefix are contiguous
+        self._sorted_words = tuple(sorted(self._vocabulary))
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple[str, str]], bodies: Optional[BodyIndex] = None) -> "MonologueIndex":
+        return cls([text for text, _ in rows], [url for _, url in rows], bodies)
+
+    def with_bodies(self, bodies: BodyIndex) -> "MonologueIndex":
+        """
+        Same index of the titles with other article bodies, nothing is rebuilt.
+        """
+        index = copy.copy(self)
+        index.bodies = bodies
+        return index
+
+    def monologue(self, position: int) -> Monologue:
+        return Monologue(self.texts[position], self.urls[position])
+
+    def lookup(self, search_string: str) -> list[int]:
+        """
+        Positions of the monologues whose title contains the search string,
+        casefolded like the titles.
+        :param search_string: the substring to look for
+        :return: sorted list of positions in the index
+        """
+        key = search_string.casefold()
+        if key == "":
+            return []
+
+        # Keys as short as the n-grams are indexed as they are
+        if len(key) <= NGRAM_SIZE:
+            return self._postings.get(key, [])
+
+        # Intersect starting from the rarest n-gram, then check the survivors
+        # since sharing all the n-grams does not imply containing the key
+        postings = sorted((self._postings.get(gram, []) for gram in _ngrams(key, NGRAM_SIZE)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(posting)
+
+        return sorted(position for position in candidates if key in self.titles[position])
+
+    def fuzzy_lookup(self, search_string: str) -> dict[int, int]:
+        """
+        Monologues with a title word close to the search string,
+        ignoring case and accents. Short words are matched with
+        no typos, see fuzzy.max_distance.
+        :param search_string: the word to look for
+        :return: the edit distance of the closest word by position in the index
+        """
+        key = fold(search_string)
+        if key == "":
+            return {}
+
+        matches = {}
+        for distance, word in self._deletions.search(key, max_distance(key)):
+            for position in self._vocabulary[word]:
+                # Words come closest first
+                matches.setdefault(position, distance)
+        return matches
+
+    def prefix_lookup(self, prefix: str) -> set[int]:
+        """
+        Monologues with a title word starting with the prefix,
+        ignoring case and accents.
+        :param prefix: the beginning of a word
+        :return: the positions in the index
+        """
+        key = fold(prefix)
+        if key == "":
+            return set()
+
+        positions = set()
+        i = bisect_left(self._sorted_words, key)
+        while i < len(self._sorted_words) and self._sorted_words[i].startswith(key):
+            positions.update(self._vocabulary[self._sorted_words[i]])
+            i += 1
+        return positions
+
+    def body_lookup(self, words: list[str], required: set[str], limit: Optional[int] = None) -> tuple[int, list[int]]:
+        """
+        Monologues whose article body contains the words, see BodyIndex.search.
+        :return: total number of hits and the positions of the top "limit" ones, best first
+        """
+        total, docs = self.bodies.search(words, required, limit)
+        positions = (self._positions.get(self.bodies.urls[doc]) for doc in docs)
+        return total, [position for position in positions if position is not None]
+
+    def __len__(self):
+        return len(self.texts)
+
+
+# Generation and indexes by schema, replaced as a whole by a single
+# assignment so a search never sees a half built or mixed state
+_current: tuple[int, dict[DbType, MonologueIndex]] = (-1, {})
+_reload_lock = threading.Lock()
+_store: Optional[MonologueStore] = None
+_watcher: Optional[threading.Thread] = None
+
+
+def _get_store() -> MonologueStore:
+    global _store
+    if _store is None:
+        _store = MonologueStore()
+    return _store
+
+
+def load_indexes() -> dict[DbType, MonologueIndex]:
+    """
+    Read a snapshot of the database and (re)build the index of every schema.
+    The new indexes are built aside and swapped in atomically, searches
+    keep using the previous ones meanwhile.
+    :return: the loaded indexes
+    """
+    global _current
+
+    with _reload_lock:
+        # Bodies never change once stored, only the new ones are read and indexed
+        _, previous = _current
+        bodies = {schema_type: previous[schema_type].bodies if schema_type in previous else BodyIndex()
+                  for schema_type in DbType}
+
+        store = _get_store()
+        with store.snapshot() as generation:
+            rows = {schema_type: store.monologues(schema_type) for schema_type in DbType}
+            new_bodies = {schema_type: store.bodies(schema_type, after_id=bodies[schema_type].last_id)
+                          for schema_type in DbType}
+
+        indexes = {schema_type: _build_index(previous.get(schema_type), rows[schema_type],
+                                             bodies[schema_type], new_bodies[schema_type])
+                   for schema_type in DbType}
+        _current = (generation, indexes)
+
+    logger.info(f"SEARCH - Loaded indexes of generation [{generation}] "
+                f"{', '.join(f'{k.value}={len(v)}/{len(v.bodies)}' for k, v in indexes.items())}")
+    return indexes
+
+
+def _build_index(previous: Optional[MonologueIndex], rows: list[tuple[str, str]], bodies: BodyIndex,
+                 new_bodies: list[tuple[int, str, str]]) -> MonologueIndex:
+    if new_bodies:
+        bodies = bodies.extended(new_bodies)
+    texts = tuple(text for text, _ in rows)
+    urls = tuple(url for _, url in rows)
+    # Downloading the bodies publishes a generation every batch,
+    # the titles are indexed again only when they have changed
+    if previous is not None and previous.texts == texts and previous.urls == urls:
+        return previous if previous.bodies is bodies else previous.with_bodies(bodies)
+    return MonologueIndex(texts, urls, bodies)
+
+
+def reload_if_changed() -> bool:
+    """
+    Rebuild the indexes if the database generation has changed.
+    :return: True if the indexes have been rebuilt
+    """
+    if _get_store().generation() == _current[0]:
+        return False
+    load_indexes()
+    return True
+
+
+def _watch(interval: float) -> None:
+    pubsub = None
+    while True:
+        # Subscribed again after a Redis error, the generation is polled meanwhile
+        if pubsub is None:
+            pubsub = subscribe_database_updates()
+        try:
+            if pubsub is not None:
+                # Woken up by the updater, or by the timeout to poll anyway
+                wait_database_update(pubsub, timeout=interval)
+            else:
+                time.sleep(interval)
+            reload_if_changed()
+        except Exception as e:
+            logger.error(f"SEARCH - Index reload failed [{e}]")
+            if pubsub is not None:
+                close_subscription(pubsub)
+                pubsub = None
+            time.sleep(interval)
+
+
+def start_index_watcher(interval: float = INDEX_RELOAD_INTERVAL) -> None:
+    """
+    Keep the indexes up to date from a background thread. The updater runs
+    in another process, it announces new generations on Redis and the
+    generation is polled every "interval" seconds in case a message is lost.
+    :param interval: seconds between two generation checks
+    """
+    global _watcher
+    if _watcher is not None:
+        return
+    _watcher = threading.Thread(target=_watch, args=(interval,), name="index-watcher", daemon=True)
+    _watcher.start()
+
+
+def get_index(schema_type: DbType) -> MonologueIndex:
+    """
+    Get the resident index of a schema.
+    Never touches the database once loaded, the indexes are
+    refreshed in background by the index watcher.
+    :param schema_type: Either DBType.MALE or DBType.FEMALE
+    :return: the index of the schema
+    """
+    _, indexes = _current
+    if not indexes:
+        indexes = load_indexes()
+    return indexes[schema_type]
+
+
+def indexes_generation() -> int:
+    """
+    Generation of the database the resident indexes were built from.
+    """
+    return _current[0]
+
+
+def search_monologue(schema_type: DbType, search_string: str = "", in_body: bool = False) -> set[Monologue]:
+    """
+    :param schema_type: Either DBType.MALE or DBType.FEMALE
+    :param search_string: substring of the title, or words of the article body
+    :param in_body: search the article bodies, they must contain all the words
+    :return: the matching monologues
+    """
 
     # By default, make no sense to look for everything
     # at least not in this method yet
     if search_string == "":
         return set()
 
-    monologues = set([Monologue.from_dict(elem) for elem in database["list"]])
-    for monologue in monologues:
-        if search_string.casefold() in monologue.text.casefold():
-            results.add(monologue)
+    index = get_index(schema_type)
+    if in_body:
+        words = tokenize(search_string)
+        _, positions = index.body_lookup(words, required=set(words))
+    else:
+        positions = index.lookup(search_string)
+    return {index.monologue(position) for position in positions}
+
+
+def rank_monologues(schema_type: DbType, keywords: list[str], limit: Optional[int] = 10,
+                    fuzzy: bool = False) -> tuple[int, list[Monologue]]:
+    """
+    Search the monologues matching the keywords and return the best ones.
+    Keywords prefixed by REQUIRED_PREFIX must all match, the others match
+    in OR. Hits are ranked by number of matched keywords, then by whole word
+    matches, then by typos (fuzzy only), then by how early a keyword appears
+    in the title.
+    :param schema_type: Either DBType.MALE or DBType.FEMALE
+    :param keywords: the words typed by the user
+    :param limit: max number of monologues to return, None for all of them
+    :param fuzzy: match title words with typos and missing accents instead of substrings
+    :return: total number of hits and the top "limit" monologues, best first
+    """
+    index = get_index(schema_type)
+    total, best = _rank(index, keywords, limit, fuzzy)
+    return total, [index.monologue(position) for position in best]
+
+
+def rank_fragments(schema_type: DbType, keywords: list[str], limit: Optional[int] = None,
+                   fuzzy: bool = False, in_body: bool = False) -> tuple[int, list[tuple[str, int]]]:
+    """
+    Like "rank_monologues", but return the HTML fragments of the
+    monologues rendered when the index was built, ready to be paginated.
+    :param in_body: search the article bodies instead of the titles, see "rank_bodies"
+    :return: total number of hits and the fragments with their size in bytes, best first
+    """
+    index = get_index(schema_type)
+    if in_body:
+        total, best = _rank_bodies(index, keywords, limit)
+    else:
+        total, best = _rank(index, keywords, limit, fuzzy)
+    return total, [(index.fragments[position], index.fragment_sizes[position]) for position in best]
+
+
+def complete_monologues(schema_type: DbType, query: str, limit: int = 20) -> list[tuple[str, str, str]]:
+    """
+    As-you-type search of the inline queries. Every word of the query must
+    be a word of the title, the last one may be incomplete while typing.
+    Shorter titles, the closest to the query, come first.
+    :param schema_type: Either DBType.MALE or DBType.FEMALE
+    :param query: the text typed so far
+    :param limit: max number of monologues to return
+    :return: (title, url, HTML fragment) of the best monologues
+    """
+    words = _WORD.findall(query)
+    if not words:
+        return []
+
+    index = get_index(schema_type)
+    # The last word is complete only when followed by a space
+    last = words.pop() if not query[-1].isspace() else None
+    matches = [set(index._vocabulary.get(fold(word), ())) for word in words]
+    if last is not None:
+        matches.append(index.prefix_lookup(last))
+
+    matches.sort(key=len)
+    positions = matches[0].intersection(*matches[1:])
+    best = heapq.nsmallest(limit, positions, key=lambda position: (len(index.texts[position]), position))
+    return [(index.texts[position], index.urls[position], index.fragments[position]) for position in best]
+
+
+def rank_bodies(schema_type: DbType, keywords: list[str], limit: Optional[int] = 10) -> tuple[int, list[Monologue]]:
+    """
+    Search the monologues whose article body contains the keywords.
+    Keywords prefixed by REQUIRED_PREFIX must all match, the others match
+    in OR, whole words only. Bodies with the keywords one after the other,
+    as typed, come first, then the others by BM25 score.
+    :param schema_type: Either DBType.MALE or DBType.FEMALE
+    :param keywords: the words typed by the user
+    :param limit: max number of monologues to return, None for all of them
+    :return: total number of hits and the top "limit" monologues, best first
+    """
+    index = get_index(schema_type)
+    total, best = _rank_bodies(index, keywords, limit)
+    return total, [index.monologue(position) for position in best]
+
+
+def _rank_bodies(index: MonologueIndex, keywords: list[str], limit: Optional[int]) -> tuple[int, list[int]]:
+    words, required = [], set()
+    for keyword in keywords:
+        is_required = keyword.startswith(REQUIRED_PREFIX)
+        keyword_words = tokenize(keyword[len(REQUIRED_PREFIX):] if is_required else keyword)
+        words.extend(keyword_words)
+        if is_required:
+            required.update(keyword_words)
+    if not words:
+        return 0, []
+    return index.body_lookup(words, required, limit)
+
+
+def _rank(index: MonologueIndex, keywords: list[str], limit: Optional[int],
+          fuzzy: bool) -> tuple[int, list[int]]:
+    """
+    Ranking of "rank_monologues" on a given index.
+    :return: total number of hits and the positions of the top "limit" ones, best first
+    """
+    required, optional = [], []
+    for keyword in keywords:
+        if keyword.startswith(REQUIRED_PREFIX):
+            keyword = keyword[len(REQUIRED_PREFIX):]
+            if keyword:
+                required.append(keyword.casefold())
+        elif keyword:
+            optional.append(keyword.casefold())
+
+    # Repeated keywords must not count twice
+    required = list(dict.fromkeys(required))
+    optional = [key for key in dict.fromkeys(optional) if key not in required]
+
+    def match(key: str) -> dict[int, int]:
+        if fuzzy:
+            return index.fuzzy_lookup(key)
+        return dict.fromkeys(index.lookup(key), 0)
+
+    # Matched keywords and their edit distance by position of the monologue
+    hits: dict[int, dict[str, int]] = {}
+    if required:
+        matches = [(key, match(key)) for key in required]
+        candidates = set.intersection(*(set(found) for _, found in matches))
+        if not candidates:
+            return 0, []
+        hits = {position: {key: found[position] for key, found in matches} for position in candidates}
+        for key in optional:
+            for position, distance in match(key).items():
+                if position in hits:
+                    hits[position][key] = distance
+    else:
+        for key in optional:
+            for position, distance in match(key).items():
+                hits.setdefault(position, {})[key] = distance
+
+    def score(position: int) -> tuple:
+        matched = hits[position]
+        title = index.titles[position]
+        words = index.words[position]
+        first = min((found for found in map(title.find, matched) if found >= 0), default=len(title))
+        return (len(matched),
+                sum(key in words for key in matched),
+                -sum(matched.values()),
+                -first,
+                -position)
 
-    return results if len(results) else set()
+    # Only the best "limit" hits are kept in the heap, no full sort
+    if limit is None:
+        best = sorted(hits, key=score, reverse=True)
+    else:
+        best = heapq.nlargest(limit, hits, key=score)
+    return len(hits), best
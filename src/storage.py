@@ -0,0 +1,329 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from const import DbType
+
+DATABASE_FILE = "database.db"
+JSON_DATABASE_FILE = "database.json"
+
+# Article bodies are stored compressed, one zlib stream per article
+BODY_COMPRESSION_LEVEL = 9
+
+# Setup logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monologues (
+    id INTEGER PRIMARY KEY,
+    schema_name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (schema_name, url)
+);
+CREATE INDEX IF NOT EXISTS monologues_by_text ON monologues (schema_name, text);
+CREATE TABLE IF NOT EXISTS bodies (
+    id INTEGER PRIMARY KEY,
+    monologue_id INTEGER NOT NULL UNIQUE REFERENCES monologues (id),
+    body BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    schema_name TEXT PRIMARY KEY,
+    last_update TEXT,
+    total_pages INTEGER NOT NULL DEFAULT 0,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0);
+"""
+
+# Columns added after the first release, created on old databases at startup
+MIGRATIONS = {
+    "metadata": {"etag": "TEXT", "last_modified": "TEXT"},
+}
+
+
+class MonologueStore:
+    """
+    SQLite store of the monologues, one table shared by all the schemas.
+    The database runs in WAL mode, so the bot can keep reading while
+    the updater writes, and every update run commits in one transaction.
+
+    Every transaction that changes the monologues or their bodies bumps the
+    database generation, the metadata of the updates alone does not.
+    Readers take a snapshot, remember its generation and reload only when
+    it changes: a crashed update is rolled back and never seen.
+
+    A new empty store imports the old JSON database, if there is one, so
+    the first start after the move to SQLite keeps all the monologues.
+
+    Example:
+        store = MonologueStore()
+        with store.transaction():
+            store.upsert(DbType.MALE, blog_posts)
+            store.set_metadata(DbType.MALE, total_pages=10, last_update="01/01/2024")
+    """
+
+    def __init__(self, path: str = DATABASE_FILE, json_path: Optional[str] = JSON_DATABASE_FILE):
+        self.path = path
+        # The connection is shared by the search threads, access is serialized
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        # Set by the writes of the indexed tables in the running transaction
+        self._modified = False
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            self._migrate()
+        if json_path and os.path.exists(json_path) and self.is_empty():
+            self._import_json(json_path)
+
+    def _import_json(self, json_path: str) -> None:
+        try:
+            migrate_from_json(self, json_path, only_if_empty=True)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"STORAGE - Could not import [{json_path}]: [{e}]")
+
+    def is_empty(self) -> bool:
+        """
+        True if the store has no monologue of any schema.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM monologues LIMIT 1").fetchone() is None
+
+    def _migrate(self) -> None:
+        for table, columns in MIGRATIONS.items():
+            existing = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Group writes in a single transaction, rolled back on error.
+        Nested calls join the outer transaction.
+        """
+        with self._lock:
+            if self._connection.in_transaction:
+                yield
+                return
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._modified = False
+            try:
+                yield
+                if self._modified:
+                    self._connection.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    @contextmanager
+    def snapshot(self) -> Iterator[int]:
+        """
+        Read transaction, every read inside sees the same committed
+        state of the database even if an update commits meanwhile.
+        :return: the generation of the snapshot
+        """
+        with self._lock:
+            if self._connection.in_transaction:
+                yield self.generation()
+                return
+            self._connection.execute("BEGIN")
+            try:
+                yield self.generation()
+            finally:
+                self._connection.execute("COMMIT")
+
+    def monologues(self, schema_name: DbType) -> list[tuple[str, str]]:
+        """
+        All the monologues of a schema in insertion order.
+        :param schema_name: Either DBType.MALE or DBType.FEMALE
+        :return: list of (text, url)
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT text, url FROM monologues WHERE schema_name = ? ORDER BY id",
+                (DbType(schema_name).value,)).fetchall()
+
+    def urls(self, schema_name: DbType) -> set[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT url FROM monologues WHERE schema_name = ?", (DbType(schema_name).value,))
+            return {url for url, in rows}
+
+    def upsert(self, schema_name: DbType, blog_posts: list[dict[str, Any]]) -> int:
+        """
+        Insert the blog posts, or update the title of the already known urls.
+        :param schema_name: Either DBType.MALE or DBType.FEMALE
+        :param blog_posts: list of dicts with "url" and "text"
+        :return: number of new monologues
+        """
+        schema = DbType(schema_name).value
+        rows = [(schema, post["url"], post["text"]) for post in blog_posts
+                if post.get("text") and post.get("url")]
+        with self.transaction():
+            before = self._count(schema)
+            cursor = self._connection.executemany(
+                "INSERT INTO monologues (schema_name, url, text) VALUES (?, ?, ?) "
+                "ON CONFLICT (schema_name, url) DO UPDATE SET text = excluded.text "
+                "WHERE text != excluded.text",
+                rows)
+            # Known urls with the same title are not counted as changes
+            self._modified |= cursor.rowcount > 0
+            return self._count(schema) - before
+
+    def missing_bodies(self, schema_name: DbType, limit: int) -> list[tuple[int, str]]:
+        """
+        Monologues whose article body has not been downloaded yet.
+        :param schema_name: Either DBType.MALE or DBType.FEMALE
+        :param limit: max number of monologues to return
+        :return: list of (monologue id, url)
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT m.id, m.url FROM monologues m LEFT JOIN bodies b ON b.monologue_id = m.id "
+                "WHERE m.schema_name = ? AND b.id IS NULL ORDER BY m.id LIMIT ?",
+                (DbType(schema_name).value, limit)).fetchall()
+
+    def add_bodies(self, bodies: list[tuple[int, str]]) -> None:
+        """
+        Store the article bodies of some monologues, compressed.
+        Bodies are written once, the ones already stored are kept.
+        :param bodies: list of (monologue id, body text)
+        """
+        rows = [(monologue_id, zlib.compress(text.encode(), BODY_COMPRESSION_LEVEL))
+                for monologue_id, text in bodies]
+        with self.transaction():
+            cursor = self._connection.executemany(
+                "INSERT OR IGNORE INTO bodies (monologue_id, body) VALUES (?, ?)", rows)
+            self._modified |= cursor.rowcount > 0
+
+    def bodies(self, schema_name: DbType, after_id: int = 0) -> list[tuple[int, str, str]]:
+        """
+        Article bodies of a schema stored after a given one, in storing order,
+        so a reader can index only the bodies it has not seen yet.
+        :param schema_name: Either DBType.MALE or DBType.FEMALE
+        :param after_id: id of the last body already read
+        :return: list of (body id, url, text)
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT b.id, m.url, b.body FROM bodies b JOIN monologues m ON m.id = b.monologue_id "
+                "WHERE m.schema_name = ? AND b.id > ? ORDER BY b.id",
+                (DbType(schema_name).value, after_id)).fetchall()
+        return [(body_id, url, zlib.decompress(body).decode()) for body_id, url, body in rows]
+
+    def _count(self, schema: str) -> int:
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM monologues WHERE schema_name = ?", (schema,)).fetchone()[0]
+
+    def metadata(self, schema_name: DbType) -> dict[str, Any]:
+        """
+        Update metadata of a schema.
+        :param schema_name: Either DBType.MALE or DBType.FEMALE
+        :return: dict with "last_update" (dd/mm/YYYY or None), "total_pages"
+                 and the "etag" and "last_modified" of the newest blog page
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT last_update, total_pages, etag, last_modified FROM metadata WHERE schema_name = ?",
+                (DbType(schema_name).value,)).fetchone()
+        if row is None:
+            return {"last_update": None, "total_pages": 0, "etag": None, "last_modified": None}
+        return {"last_update": row[0], "total_pages": row[1], "etag": row[2], "last_modified": row[3]}
+
+    def set_metadata(self, schema_name: DbType, total_pages: int, last_update: Optional[str],
+                     etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        with self.transaction():
+            self._connection.execute(
+                "INSERT INTO metadata (schema_name, last_update, total_pages, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (schema_name) DO UPDATE SET "
+                "last_update = excluded.last_update, total_pages = excluded.total_pages, "
+                "etag = excluded.etag, last_modified = excluded.last_modified",
+                (DbType(schema_name).value, last_update, total_pages, etag, last_modified))
+
+    def generation(self) -> int:
+        """
+        Generation of the committed database, bumped by every transaction
+        that changes the monologues or their bodies.
+        """
+        with self._lock:
+            return self._connection.execute("SELECT value FROM generation WHERE id = 0").fetchone()[0]
+
+
+def migrate_from_json(store: MonologueStore, json_path: str = JSON_DATABASE_FILE,
+                      only_if_empty: bool = False) -> None:
+    """
+    One-shot import of the old database.json into the store.
+    Safe to run again, known urls are only updated.
+    :param store: the destination store
+    :param json_path: path of the JSON database
+    :param only_if_empty: import nothing if the store already has monologues,
+        as when several processes open a new store at the same time
+    """
+    with open(json_path, "r") as db:
+        database = json.load(db)
+
+    with store.transaction():
+        if only_if_empty and not store.is_empty():
+            return
+        for schema_name in DbType:
+            schema = database.get(schema_name.value)
+            if schema is None:
+                continue
+            added = store.upsert(schema_name, schema.get("list", []))
+            store.set_metadata(schema_name,
+                               total_pages=schema.get("total_pages", 0),
+                               last_update=schema.get("last_update"))
+            logger.info(f"STORAGE - Migrated [{added}] monologues for {schema_name.value}")
+
+
+def main_parser() -> int:
+    """
+    Command line argument parsing for the STORAGE tools.
+    :return: 0 for success, -1 for failure.
+    """
+    parser = argparse.ArgumentParser(description='Manage the monologues database.')
+    parser.add_argument('command',
+                        type=str,
+                        choices=['migrate'],
+                        help='"migrate" imports the old JSON database into the SQLite one')
+    parser.add_argument('--json',
+                        type=str,
+                        required=False,
+                        help='Path of the JSON database to migrate',
+                        default=JSON_DATABASE_FILE)
+    args = parser.parse_args()
+
+    try:
+        store = MonologueStore()
+        migrate_from_json(store, args.json)
+        store.close()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f'Migration failed: [{e}]')
+        return -1
+    return 0
+
+
+if __name__ == '__main__':
+    main_parser()
@@ -1,13 +1,24 @@
-import json, links
 import logging
-import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 from datetime import datetime
 from time import sleep
+from typing import Optional
+
+import requests
+from celery import chord
+from celery.signals import worker_process_shutdown, worker_shutdown
+from selenium.common.exceptions import WebDriverException
 
 from celery_app import app
 from const import DbType, URL_BY_TYPE
-from scraper import async_monologue_scraper, get_total_pagination_counter
+from env import SCRAPER_WORKERS
+from locks import update_lock
+from notifications import publish_database_update
+from scraper import DriverSession, FirstPage, async_monologue_scraper, fetch_article_body, probe_first_page
+from storage import MonologueStore
 
 # Setup logging
 logging.basicConfig(
@@ -15,71 +26,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def check_outdated_db(timestamp: datetime = None, schema_name: str = DbType.MALE.value) -> bool:
-    """
-    Check if the database is up to date based on the timestamp.
-    :param timestamp:
-    :param schema_name: Which schema to use either DBType.MALE or DBType.FEMALE values
-    :return: True or False
-    """
-    if timestamp is None:
-        timestamp = datetime.now()
+# Attempts of a page scraping task before the whole update fails
+PAGE_RETRIES = 3
 
-    with open('database.json') as db:
-        database = json.load(db)
+# Article bodies downloaded and committed together
+BODY_BATCH = 50
 
-    db_last_update_date = datetime.strptime(database[schema_name]["last_update"], '%d/%m/%Y')
-    if timestamp > db_last_update_date:
-        print(f'Database is outdated. Last update on [{db_last_update_date}] requested update by [{timestamp}]')
-        return True
-    else:
-        print("Database is up to date")
-        return False
+# Chrome of the worker process, shared by its page tasks, see "_worker_session"
+_session: Optional[DriverSession] = None
+_session_lock = threading.Lock()
 
 
-def update_monologues_by_page(schema_name: DbType, page_number: int = 0):
+def scrape_page(schema_name: DbType, page_number: int = 0, session: DriverSession = None) -> list[dict]:
     """
-    Update the monologues database given schema name and page number.
+    Scrape the monologues of a page of the RC blog.
     :param schema_name: Database schema name either DBType.MALE or DBType.FEMALE
     :param page_number: The RC blog pagination number e.g the "page" query param
-    :return: None
+    :param session: Chrome session shared by the pages of a run, optional
+    :return: list of dicts with "url" and "text"
     """
-
-    url = URL_BY_TYPE[schema_name]
+    url = URL_BY_TYPE[DbType(schema_name).value]
 
     # creating link for update monologues of a specific page
     page_url = url + f"?page={page_number}"
 
     # call scraper
-    blog_posts = async_monologue_scraper(page_url)
-
-    with open('database.json') as db:
-        database = json.load(db)
-
-    monologue_list = database[schema_name]["list"]
-    monologue_names = [e["text"] for e in database[schema_name]["list"]]
-
-    # updating monologues avoiding duplicates
-    blog_posts = [b for b in blog_posts if b['text'] is not None and b['text'] != ""]
-    for blog_post in blog_posts:
-        if not blog_post["text"] in monologue_names:
-            monologue_list.append(blog_post)
-
-    # updating db
-    if url == links.MALE_MONOLOGUES:
-        database['male_monologues']["list"] = monologue_list
-    else:
-        database['female_monologues']["list"] = monologue_list
-
-    # saving updates
-    with open('database.json', 'w') as db:
-        json.dump(database, db)
-
-    logger.info(f'Done. Updated monologues database for {schema_name}')
+    blog_posts = async_monologue_scraper(page_url, session=session)
+    return [b for b in blog_posts if b['text'] is not None and b['text'] != ""]
 
 
 @app.task
-def update_monologues(schema_name: DbType) -> None:
+def update_monologues(schema_name: str) -> None:
     """
     Async Task.
     Update the monologues database given schema name.
@@ -89,55 +66,313 @@ def update_monologues(schema_name: DbType) -> None:
     select the subset of pages to scrape.
 
     The RC blog has the most recent articles at page 0.
-    The bot parses the required pages up to the latest saved monologue.
-    :param schema_name: Either DBType.MALE or DBType.FEMALE
+    The bot parses the required pages up to the latest saved monologue:
+    an unchanged blog costs one conditional request, otherwise pages are
+    scraped until one with only known monologues is found.
+
+    Pages are scraped by "scrape_page_task" tasks, fanned out in chords so
+    several workers share an update and a failed page is retried alone.
+    The "commit_pages" callback merges them and starts the next batch or,
+    when done, commits the whole update at once. If a page fails for good
+    the chord runs "release_update_lock" instead.
+
+    Only one update per schema runs at a time: if one is already running
+    this trigger joins it and does nothing.
+    :param schema_name: Either DBType.MALE or DBType.FEMALE value
     :return: None
     """
+    schema_name = DbType(schema_name)
+
+    token = update_lock.acquire(schema_name)
+    if token is None:
+        logger.info(f'UPDATER - Joined running update of {schema_name.value}')
+        return
+
+    logger.info(f'UPDATER - Updating monologues database for {schema_name.value}')
+    store = MonologueStore()
+    try:
+        # The articles and the pagination of the fallback come from one browser
+        with DriverSession() as session:
+            first_page = _probe_first_page(schema_name, store, session)
+        if first_page is None:
+            update_lock.release(schema_name, token)
+            fetch_bodies_task.delay(schema_name.value)
+            return
+        state = {"first_page": asdict(first_page), "blog_posts": first_page.blog_posts,
+                 "next_page": 1, "batch_size": 1, "lock": token}
+        if _is_known_page(first_page.blog_posts, store.urls(schema_name)):
+            _commit(store, schema_name, first_page, first_page.blog_posts)
+            update_lock.release(schema_name, token)
+            fetch_bodies_task.delay(schema_name.value)
+            return
+        _fan_out(schema_name, state)
+    except BaseException:
+        update_lock.release(schema_name, token)
+        raise
+    finally:
+        store.close()
+
+
+def _fan_out(schema_name: DbType, state: dict) -> None:
+    """
+    Start a chord scraping the next batch of pages.
+    Batches start from a single page and double up to SCRAPER_WORKERS pages.
+    :param schema_name: Either DBType.MALE or DBType.FEMALE
+    :param state: the update state, see "update_monologues"
+    """
+    total_pages = state["first_page"]["total_pages"]
+    batch = range(state["next_page"], min(state["next_page"] + state["batch_size"], total_pages + 1))
+    state = {**state, "next_page": batch.stop, "batch_size": min(state["batch_size"] * 2, SCRAPER_WORKERS)}
 
-    logger.info(f'UPDATER - Updating monologues database for {schema_name}')
-    # Checking last DB update to understand how many
-    # pages of the Blog to parse
-    url = URL_BY_TYPE[schema_name]
+    logger.info(f"UPDATER - Scraping pages [{batch.start}-{batch.stop - 1}] of {schema_name.value}")
+    callback = commit_pages.s(schema_name.value, state).on_error(
+        release_update_lock.si(schema_name.value, state["lock"]))
+    chord(scrape_page_task.s(schema_name.value, index) for index in batch)(callback)
 
-    # The current RC blog pages for monologues
-    total_pages = get_total_pagination_counter(url)
 
-    with open('database.json') as db:
-        database = json.load(db)
+@app.task(autoretry_for=(requests.RequestException, WebDriverException),
+          retry_backoff=True, max_retries=PAGE_RETRIES)
+def scrape_page_task(schema_name: str, page_number: int) -> list[dict]:
+    """
+    Async Task.
+    Scrape a page of the RC blog, retried alone if it fails.
+    The pages served by the same worker process share its Chrome, see
+    "_worker_session". The time spent on the page is logged like the
+    pages of "run_update".
+    :param schema_name: Either DBType.MALE or DBType.FEMALE value
+    :param page_number: The RC blog pagination number
+    :return: list of dicts with "url" and "text"
+    """
+    session = _worker_session()
+    try:
+        return scrape_page(schema_name, page_number, session=session)
+    finally:
+        # Already logged page by page, the worker lives for days
+        session.timings.clear()
+
+
+def _worker_session() -> DriverSession:
+    """
+    Chrome session of the worker process, created on the first page task.
+    Like the session of "run_update" the browser is started only if a page
+    needs it, then checked and recycled by the session itself.
+    :return: the DriverSession of the process
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = DriverSession()
+        return _session
+
 
-    # How many pages have been already scraped in the past
-    total_db_pages = database[schema_name]['total_pages']
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_worker_session(**kwargs) -> None:
+    """
+    Quit the Chrome of the worker process, if any, when the process stops.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
 
-    # Calculating delta e.g how many pages of the blog to scrape
-    delta = total_pages - total_db_pages
 
-    if delta == 0:
-        if check_outdated_db(timestamp=datetime.now(), schema_name=schema_name):
-            logger.info(f"Delta is 0 but database is outdated. Last update on {database[schema_name]['last_update']}. Updating only page 0")
-        else:
-            logger.info("Nothing to do. Database is up to date")
+@app.task
+def commit_pages(pages: list[list[dict]], schema_name: str, state: dict) -> None:
+    """
+    Async Task.
+    Chord callback of a batch of "scrape_page_task". Scrapes the next batch
+    if no page with only known monologues has been found yet, otherwise
+    commits all the monologues of the update.
+    :param pages: the monologues of each page of the batch, in page order
+    :param schema_name: Either DBType.MALE or DBType.FEMALE value
+    :param state: the update state, see "update_monologues"
+    """
+    schema_name = DbType(schema_name)
+    first_page = FirstPage(**state["first_page"])
+    blog_posts = list(state["blog_posts"])
+    token = state["lock"]
+
+    store = MonologueStore()
+    try:
+        known_urls = store.urls(schema_name)
+        done = False
+        for page in pages:
+            blog_posts.extend(page)
+            if _is_known_page(page, known_urls):
+                done = True
+                break
+
+        if done or state["next_page"] > first_page.total_pages:
+            _commit(store, schema_name, first_page, blog_posts)
+            update_lock.release(schema_name, token)
+            fetch_bodies_task.delay(schema_name.value)
             return
 
-    logger.info(f"Pages to be scraped [{delta}] ")
+        # Still running, keep the other triggers out
+        update_lock.refresh(schema_name, token)
+        _fan_out(schema_name, {**state, "blog_posts": blog_posts})
+    except BaseException:
+        update_lock.release(schema_name, token)
+        raise
+    finally:
+        store.close()
 
-    # Updating from page 0 to delta
-    for index in range(0, delta + 1):
-        update_monologues_by_page(schema_name=schema_name, page_number=index)
-        time.sleep(3)
 
-    # Reopen updated db
-    with open('database.json') as db:
-        database = json.load(db)
+@app.task
+def release_update_lock(schema_name: str, token: str) -> None:
+    """
+    Async Task.
+    Error callback of the chords of an update: a page failed after all its
+    retries, or "commit_pages" did, so the update is over. The lock is
+    released at once instead of after LOCK_TTL, otherwise the next triggers
+    would join an update that is not running anymore.
+    :param schema_name: Either DBType.MALE or DBType.FEMALE value
+    :param token: the lock token of the update
+    """
+    logger.error(f'UPDATER - Update of {schema_name} failed, releasing its lock')
+    update_lock.release(DbType(schema_name), token)
 
-    # updating total pages in db
-    database[schema_name]['total_pages'] = total_pages
 
-    # Setting date of last update
-    database[schema_name]["last_update"] = datetime.now().strftime('%d/%m/%Y')
+@app.task
+def fetch_bodies_task(schema_name: str) -> None:
+    """
+    Async Task.
+    Download a batch of the article bodies still missing, for the full
+    text search, and start the next batch until all are downloaded.
+    Started at the end of every update, so only the new articles are
+    downloaded once the first run has filled the database.
+    :param schema_name: Either DBType.MALE or DBType.FEMALE value
+    """
+    store = MonologueStore()
+    try:
+        more = fetch_bodies(DbType(schema_name), store)
+    finally:
+        store.close()
+    if more:
+        fetch_bodies_task.delay(schema_name)
 
-    # saving updates
-    with open('database.json', 'w') as db:
-        json.dump(database, db)
+
+def fetch_bodies(schema_name: DbType, store: MonologueStore, limit: int = BODY_BATCH) -> bool:
+    """
+    Download and commit the article bodies of up to "limit" monologues that have none.
+    Articles that could not be downloaded are retried by the next run.
+    :param schema_name: Either DBType.MALE or DBType.FEMALE
+    :param store: the monologues store
+    :param limit: max number of articles to download
+    :return: True if there may be more bodies to download
+    """
+    missing = store.missing_bodies(schema_name, limit)
+    if not missing:
+        return False
+
+    with ThreadPoolExecutor(max_workers=SCRAPER_WORKERS, thread_name_prefix="bodies") as executor:
+        texts = executor.map(lambda row: fetch_article_body(row[1]), missing)
+        bodies = [(monologue_id, text) for (monologue_id, _), text in zip(missing, texts) if text is not None]
+
+    if bodies:
+        store.add_bodies(bodies)
+        publish_database_update(store.generation())
+    logger.info(f'Done. Added [{len(bodies)}/{len(missing)}] article bodies for {schema_name.value}')
+
+    # A batch with no download at all means the blog is unreachable, stop here
+    return len(missing) == limit and len(bodies) > 0
+
+
+def run_update(schema_name: DbType) -> None:
+    """
+    Same update of "update_monologues" in the current process, with no
+    workers: pages are scraped by threads and, if Chrome is needed,
+    one browser serves the whole run.
+    :param schema_name: Either DBType.MALE or DBType.FEMALE
+    :return: None
+    """
+    schema_name = DbType(schema_name)
+
+    token = update_lock.acquire(schema_name)
+    if token is None:
+        logger.info(f'UPDATER - Joined running update of {schema_name.value}')
+        return
+
+    logger.info(f'UPDATER - Updating monologues database for {schema_name.value}')
+    store = MonologueStore()
+    try:
+        with DriverSession() as session:
+            _update_monologues(schema_name, store, session)
+            session.log_timings()
+        while fetch_bodies(schema_name, store):
+            pass
+    finally:
+        store.close()
+        update_lock.release(schema_name, token)
+
+
+def _probe_first_page(schema_name: DbType, store: MonologueStore,
+                      session: DriverSession = None) -> Optional[FirstPage]:
+    # The newest page is downloaded only if it changed since the last run
+    metadata = store.metadata(schema_name)
+    first_page = probe_first_page(URL_BY_TYPE[schema_name.value] + "?page=0",
+                                  etag=metadata["etag"],
+                                  last_modified=metadata["last_modified"],
+                                  session=session)
+    if first_page is None:
+        logger.info("Nothing to do. The blog has not changed since the last update")
+    return first_page
+
+
+def _commit(store: MonologueStore, schema_name: DbType, first_page: FirstPage, blog_posts: list[dict]) -> None:
+    with store.transaction():
+        added = store.upsert(schema_name, blog_posts)
+
+        # updating total pages, validators of the newest page and setting date of last update
+        store.set_metadata(schema_name,
+                           total_pages=first_page.total_pages,
+                           last_update=datetime.now().strftime('%d/%m/%Y'),
+                           etag=first_page.etag,
+                           last_modified=first_page.last_modified)
+
+    # The bot rebuilds its search indexes as soon as it knows
+    publish_database_update(store.generation())
+    logger.info(f'Done. Added [{added}] monologues to database for {schema_name.value}')
+
+
+def _update_monologues(schema_name: DbType, store: MonologueStore, session: DriverSession) -> None:
+    first_page = _probe_first_page(schema_name, store, session)
+    if first_page is None:
+        return
+
+    known_urls = store.urls(schema_name)
+    blog_posts = list(first_page.blog_posts)
+
+    # Following pages are scraped in parallel batches, until a page with only
+    # known monologues (or no monologues at all) is found. Batches start from
+    # a single page, usual nightly runs find known monologues right away,
+    # and double up to SCRAPER_WORKERS pages
+    if not _is_known_page(first_page.blog_posts, known_urls):
+        with ThreadPoolExecutor(max_workers=SCRAPER_WORKERS, thread_name_prefix="scraper") as executor:
+            next_page = 1
+            batch_size = 1
+            done = False
+            while not done and next_page <= first_page.total_pages:
+                batch = range(next_page, min(next_page + batch_size, first_page.total_pages + 1))
+                batch_size = min(batch_size * 2, SCRAPER_WORKERS)
+                logger.info(f"Scraping pages [{batch.start}-{batch.stop - 1}]")
+
+                pages = executor.map(lambda index: scrape_page(schema_name=schema_name, page_number=index,
+                                                               session=session), batch)
+                for page in pages:
+                    blog_posts.extend(page)
+                    if _is_known_page(page, known_urls):
+                        done = True
+                        break
+                next_page = batch.stop
+
+    _commit(store, schema_name, first_page, blog_posts)
+
+
+def _is_known_page(blog_posts: list[dict], known_urls: set[str]) -> bool:
+    return all(blog_post["url"] in known_urls for blog_post in blog_posts)
 
 
 def main_parser() -> int:
@@ -187,9 +422,9 @@ def main_parser() -> int:
     if update_all:
         logger.info(f'Request to update monologues for all schemas.')
         for e in [v.value for v in DbType]:
-            update_monologues(schema_name=e)
+            run_update(schema_name=e)
     else:
-        update_monologues(schema_name=args.dbtype)
+        run_update(schema_name=args.dbtype)
     return 0
 
 if __name__ == '__main__':
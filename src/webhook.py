@@ -0,0 +1,106 @@
+import hmac
+import json
+import logging
+
+from telegram import Update
+from telegram.ext import Application
+
+# Setup logging
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhook"
+# Answered with 200 while the worker is up, for the load balancer
+HEALTH_PATH = "/health"
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+# Updates are a few KB, anything bigger is not from Telegram
+MAX_BODY_SIZE = 1 << 20
+
+
+class WebhookApp:
+    """
+    Minimal ASGI app receiving the updates that Telegram POSTs to the
+    webhook and queueing them to a python-telegram-bot Application,
+    which is started and stopped with the ASGI lifespan.
+
+    Requests without the secret token set with "setWebhook" are refused,
+    the update is acknowledged as soon as it is queued.
+
+    Example:
+        uvicorn.run(WebhookApp(application, secret_token), port=PORT)
+
+        # locally, with a recorded update
+        curl -X POST -H "X-Telegram-Bot-Api-Secret-Token: <secret>" \
+             -H "Content-Type: application/json" -d @update.json localhost:5000/webhook
+    """
+
+    def __init__(self, application: Application, secret_token: str, path: str = WEBHOOK_PATH):
+        self.application = application
+        self.path = path
+        self._secret_token = secret_token.encode()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            status = await self._handle(scope, receive)
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"text/plain"), (b"content-length", b"0")]})
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.application.initialize()
+                    await self.application.start()
+                except Exception as e:
+                    logger.error(f"WEBHOOK - Could not start the bot [{e}]")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.application.stop()
+                await self.application.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _handle(self, scope, receive) -> int:
+        """
+        :return: the HTTP status of the answer
+        """
+        if scope["path"] == HEALTH_PATH and scope["method"] == "GET":
+            return 200
+        if scope["path"] != self.path:
+            return 404
+        if scope["method"] != "POST":
+            return 405
+
+        headers = dict(scope["headers"])
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, b""), self._secret_token):
+            logger.warning(f"WEBHOOK - Refused update without a valid secret token from {scope.get('client')}")
+            return 403
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(body) > MAX_BODY_SIZE:
+                return 413
+
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError("not a JSON object")
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"WEBHOOK - Malformed update [{e}]")
+            return 400
+
+        await self.application.update_queue.put(update)
+        return 200
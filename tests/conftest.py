@@ -0,0 +1,76 @@
+import os
+import random
+import sys
+
+import pytest
+
+# Modules of the bot import each other by name, as when run from src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from const import DbType  # noqa: E402
+
+# Latency budget of an inline answer, it must keep up with the typing
+MAX_KEYSTROKE_P99 = 0.01
+
+# Pages of the blog saved for the scraper tests
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+WORDS = ["amleto", "amore", "addio", "lettera", "padre", "madre", "figlio", "notte", "mare",
+         "guerra", "sogno", "perché", "città", "verità", "ultimo", "giorno", "follia", "silenzio",
+         "tempesta", "ritorno", "rosa", "nero", "vento", "paura", "coraggio", "segreto"]
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def make_rows(count: int, seed: int = 0) -> list[tuple[str, str]]:
+    """
+    Synthetic catalogue of "count" monologues, the same for the same seed.
+    :return: list of (title, url) like MonologueStore.monologues
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+        rows.append((f"{title} {i}", f"https://blog.example/monologo-{i}"))
+    return rows
+
+
+@pytest.fixture
+def indexes(monkeypatch):
+    """
+    Install resident indexes of synthetic monologues, no database needed.
+    :return: a function taking the rows by schema
+    """
+    import search
+
+    def install(rows_by_schema: dict, generation: int = 1) -> dict:
+        loaded = {schema_type: search.MonologueIndex.from_rows(rows_by_schema.get(schema_type, []))
+                  for schema_type in DbType}
+        monkeypatch.setattr(search, "_current", (generation, loaded))
+        return loaded
+
+    return install
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    Empty monologue store in a temporary directory, also used by the search module.
+    """
+    import search
+    from storage import MonologueStore
+
+    monkeypatch.chdir(tmp_path)
+    monologue_store = MonologueStore(str(tmp_path / "database.db"))
+    monkeypatch.setattr(search, "_store", monologue_store)
+    monkeypatch.setattr(search, "_current", (-1, {}))
+    yield monologue_store
+    monologue_store.close()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,253 @@
+import asyncio
+import gc
+import json
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+pytest.importorskip("telegram")
+pytest.importorskip("celery")
+
+from conftest import make_rows, percentile  # noqa: E402
+from const import DbType, RESULT_PAGE  # noqa: E402
+
+USERS = 50
+SEARCHES_PER_USER = 2
+# Users press a button every CLICK_INTERVAL during the searches
+CLICK_INTERVAL = 0.01
+# Latency of the cheap handlers that the searches may add: the handlers still
+# wait for the GIL held by the search threads, about 0.1s at the worst. A
+# search run on the event loop delays the clicks for the whole burst, seconds
+MAX_ADDED_LATENCY = 0.2
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # The conversation texts are read from the working directory at import
+    from conversation import ConversationType
+
+    directory = tmp_path_factory.mktemp("bot")
+    with open(directory / "conversation.json", "w", encoding="utf-8") as f:
+        json.dump({conversation_type.value: ["Ciao"] for conversation_type in ConversationType}, f)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+@pytest.fixture(autouse=True)
+def search_slots(app, monkeypatch):
+    # asyncio primitives belong to the loop that first waits on them, one per test
+    monkeypatch.setattr(app, "search_slots", asyncio.Semaphore(app.SEARCH_CONCURRENCY))
+
+
+def _message_update():
+    message = SimpleNamespace(reply_text=AsyncMock(), text="")
+    return SimpleNamespace(message=message, effective_chat=SimpleNamespace(id=1))
+
+
+def _page_update(search_id: int, page: int):
+    query = SimpleNamespace(data=f"{RESULT_PAGE}:{search_id}:{page}", answer=AsyncMock(),
+                            edit_message_text=AsyncMock(), edit_message_reply_markup=AsyncMock())
+    return SimpleNamespace(callback_query=query)
+
+
+def test_handlers_answer_while_searches_run(app, indexes):
+    """
+    USERS users search at the same time while others press /start and browse
+    result pages: the cheap handlers must answer about as fast as with no searches.
+    """
+    indexes({DbType.MALE: make_rows(10000), DbType.FEMALE: make_rows(10000, seed=1)})
+    context = SimpleNamespace(user_data={app.RESULTS_KEY: {"id": 0, "pages": ("uno", "due"), "page": 0}})
+
+    async def user(number: int) -> None:
+        for i in range(SEARCHES_PER_USER):
+            # Distinct keywords, so no answer comes from the cache
+            await app.search_async([f"a{number}", "amore", f"{i}"], DbType.MALE)
+
+    async def clicks(done) -> list[float]:
+        """
+        A click every CLICK_INTERVAL until done(). The latency of a click runs
+        from when it is due, so the time spent waiting for a busy event loop
+        counts as well as the time of the handlers.
+        """
+        latencies = []
+        due = time.perf_counter()
+        while not done():
+            # The updates as they come from Telegram, built ahead of time
+            message, page = _message_update(), _page_update(0, 1)
+            await asyncio.sleep(due - time.perf_counter())
+            await app.start(message, context)
+            await app.result_page(page, context)
+            latencies.append(time.perf_counter() - due)
+            # A slow click does not make the next ones late
+            due = max(due + CLICK_INTERVAL, time.perf_counter())
+        return latencies
+
+    async def idle() -> list[float]:
+        end = time.perf_counter() + 1
+        return await clicks(lambda: time.perf_counter() > end)
+
+    async def busy() -> list[float]:
+        searches = None
+        # The clicks are due before the searches start
+        latencies = asyncio.create_task(clicks(lambda: searches.done()))
+        searches = asyncio.gather(*(user(number) for number in range(USERS)))
+        await searches
+        return await latencies
+
+    # A full collection of the catalogues would land in one run only
+    gc.collect()
+    baseline = percentile(asyncio.run(idle()), 0.99)
+    gc.collect()
+    latencies = asyncio.run(busy())
+
+    p99 = percentile(latencies, 0.99)
+    assert p99 < baseline + MAX_ADDED_LATENCY, f"p99 {p99:.3f}s with searches, {baseline:.3f}s without"
+    # The handlers kept running during the whole burst of searches
+    assert len(latencies) > 10
+
+
+def test_search_async_is_bounded(app, indexes, monkeypatch):
+    """
+    No more than SEARCH_CONCURRENCY searches run at the same time.
+    """
+    indexes({DbType.MALE: make_rows(100)})
+    running = 0
+    peak = 0
+
+    def slow_search(search_str, db_type):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        time.sleep(0.01)
+        running -= 1
+        return "ok",
+
+    monkeypatch.setattr(app, "search", slow_search)
+
+    async def run() -> None:
+        await asyncio.gather(*(app.search_async(["amore"], DbType.MALE) for _ in range(USERS)))
+
+    asyncio.run(run())
+    assert peak <= app.SEARCH_CONCURRENCY
+
+
+def test_result_pages_come_from_user_data(app, monkeypatch):
+    """
+    The next pages of the results are served from user_data, no search again.
+    """
+    def no_search(*args, **kwargs):
+        raise AssertionError("searched again")
+
+    monkeypatch.setattr(app, "search", no_search)
+    monkeypatch.setattr(app, "rank_fragments", no_search)
+    pages = ("uno", "due", "tre")
+    context = SimpleNamespace(user_data={app.RESULTS_KEY: {"id": 4, "pages": pages, "page": 0}})
+
+    for page in (2, 1):
+        update = _page_update(4, page)
+        asyncio.run(app.result_page(update, context))
+        edit = update.callback_query.edit_message_text.await_args.kwargs
+        assert edit["text"] == pages[page]
+        assert edit["reply_markup"] == app.results_keyboard(4, page, len(pages))
+        assert context.user_data[app.RESULTS_KEY]["page"] == page
+
+    # Buttons of an older search
+    update = _page_update(3, 1)
+    asyncio.run(app.result_page(update, context))
+    assert update.callback_query.edit_message_text.await_count == 0
+    assert update.callback_query.edit_message_reply_markup.await_args.kwargs == {"reply_markup": None}
+
+
+def test_body_section_counts_every_text_match(app, monkeypatch):
+    """
+    The section of the article bodies reports how many texts match, not how
+    many are listed after the cap and the monologues already found by title.
+    """
+    title_hits = [("<b>Nome:</b> Amleto\n", 20)]
+    body_hits = title_hits + [(f"<b>Nome:</b> Testo {i}\n", 20) for i in range(app.BODY_RESULTS - 1)]
+
+    def rank_fragments(db_type, keywords, limit=None, fuzzy=False, in_body=False):
+        return (45, body_hits[:limit]) if in_body else (1, title_hits)
+
+    monkeypatch.setattr(app, "rank_fragments", rank_fragments)
+    answer = "".join(app._search(["amleto"], DbType.MALE))
+    assert "<b>Parole trovate nel testo di 45 monologhi, i più pertinenti:</b>" in answer
+    # Listed once, by title
+    assert answer.count("Amleto") == 1
+
+
+def test_inline_results_are_cached(app, indexes):
+    """
+    Inline queries come one per keystroke, the ones typed again by another
+    user are answered by the cache. The latency is tested on
+    "complete_monologues" in test_search.
+    """
+    rows = make_rows(10000)
+    indexes({DbType.MALE: rows, DbType.FEMALE: make_rows(10000, seed=1)}, generation=7)
+    app.inline_cache.clear()
+
+    typed = " ".join(rows[0][0].split()[:3])
+    for end in range(1, len(typed) + 1):
+        results = app.inline_results(typed[:end])
+        assert len(results) <= 2 * app.INLINE_RESULTS
+        assert len({result.id for result in results}) == len(results)
+        assert {result.description for result in results} <= set(app.INLINE_LABELS.values())
+
+    # Typed again by another user, same answer from the cache
+    hits = app.inline_cache.hits
+    assert app.inline_results(typed[:4]) is app.inline_results(typed[:4])
+    assert app.inline_cache.hits == hits + 2
+
+
+def _menu_update(data: str, message_id: int):
+    message = SimpleNamespace(message_id=message_id, reply_text=AsyncMock())
+    query = SimpleNamespace(data=data, message=message, answer=AsyncMock(),
+                            edit_message_text=AsyncMock(), edit_message_reply_markup=AsyncMock())
+    return SimpleNamespace(callback_query=query)
+
+
+def _chat_requests(update) -> int:
+    # Requests counted by the flood control of the chat, the answers of the queries are not
+    query = update.callback_query
+    return (query.edit_message_text.await_count + query.edit_message_reply_markup.await_count
+            + query.message.reply_text.await_count)
+
+
+def test_menu_buttons_cost_one_request(app):
+    from const import CONTINUE, END, MALE_MONOLOGUES
+    from telegram.ext import ConversationHandler
+
+    context = SimpleNamespace(user_data={app.RESULTS_KEY: {"id": 0, "pages": ("uno",), "page": 0,
+                                                           "message_id": 5}})
+
+    # Continua: the menu takes the place of the buttons of the results
+    update = _menu_update(str(CONTINUE), message_id=5)
+    assert asyncio.run(app.menu_handler(update, context)) == app.MENU
+    assert _chat_requests(update) == 1
+    markup = update.callback_query.edit_message_reply_markup.await_args.kwargs["reply_markup"]
+    assert markup == app.menu_keyboard()
+
+    # Then Maschili on the same message, the results stay
+    update = _menu_update(str(MALE_MONOLOGUES), message_id=5)
+    assert asyncio.run(app.menu_handler(update, context)) == MALE_MONOLOGUES
+    assert _chat_requests(update) == 1
+    assert update.callback_query.edit_message_text.await_count == 0
+    assert update.callback_query.answer.await_args.args == (app.SEARCH_PROMPTS[MALE_MONOLOGUES],)
+
+    # Maschili on the menu of /start, its text is replaced as before
+    update = _menu_update(str(MALE_MONOLOGUES), message_id=1)
+    assert asyncio.run(app.menu_handler(update, context)) == MALE_MONOLOGUES
+    assert _chat_requests(update) == 1
+    assert update.callback_query.edit_message_text.await_count == 1
+
+    update = _menu_update(str(END), message_id=5)
+    assert asyncio.run(app.menu_handler(update, context)) == ConversationHandler.END
+    assert _chat_requests(update) == 1
@@ -0,0 +1,68 @@
+import cache
+from cache import ResultCache
+
+
+def test_least_recently_used_is_evicted():
+    results = ResultCache(max_size=2, ttl=60)
+    results.put("a", 1, "A")
+    results.put("b", 1, "B")
+    # "a" used last, "b" goes
+    assert results.get("a", 1) == "A"
+    results.put("c", 1, "C")
+    assert results.get("b", 1) is None
+    assert results.get("a", 1) == "A"
+    assert results.get("c", 1) == "C"
+    assert results.stats()["size"] == 2
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    results = ResultCache(max_size=10, ttl=60)
+    results.put("a", 1, "A")
+
+    now[0] += 59
+    assert results.get("a", 1) == "A"
+    now[0] += 2
+    assert results.get("a", 1) is None
+    assert results.stats()["size"] == 0
+
+
+def test_new_generation_invalidates():
+    results = ResultCache(max_size=10, ttl=60)
+    results.put("a", 1, "A")
+    assert results.get("a", 2) is None
+    # The stale entry is dropped, not served back to an older reader
+    assert results.get("a", 1) is None
+    results.put("a", 2, "A2")
+    assert results.get("a", 2) == "A2"
+
+
+def test_hits_and_misses_are_counted():
+    results = ResultCache(max_size=10, ttl=60)
+    assert results.get("a", 1) is None
+    results.put("a", 1, "A")
+    assert results.get("a", 1) == "A"
+    assert results.get("a", 1) == "A"
+    assert results.stats() == {"hits": 2, "misses": 1, "hit_rate": 0.667, "size": 1, "bytes": 0}
+
+
+def test_bounded_by_total_size():
+    results = ResultCache(max_size=100, ttl=60, max_bytes=10, sizeof=len)
+    results.put("a", 1, "aaaa")
+    results.put("b", 1, "bbbb")
+    results.put("c", 1, "cccc")
+    # 12 bytes, the least recently used goes
+    assert results.get("a", 1) is None
+    assert results.stats()["bytes"] == 8
+
+    # Too big alone, not cached and nothing evicted for it
+    results.put("d", 1, "d" * 11)
+    assert results.get("d", 1) is None
+    assert results.get("b", 1) == "bbbb" and results.get("c", 1) == "cccc"
+
+    # Replaced entries are counted once
+    results.put("b", 1, "bb")
+    assert results.stats()["bytes"] == 6
+    results.clear()
+    assert results.stats()["bytes"] == 0
@@ -0,0 +1,63 @@
+import search
+from const import DbType
+from fuzzy import DeletionIndex, damerau_levenshtein, fold, max_distance
+
+ROWS = [("Amleto, essere o non essere", "https://blog.example/amleto"),
+        ("Perché mi hai lasciato", "https://blog.example/perche"),
+        ("Il mare d'inverno", "https://blog.example/mare"),
+        ("La città ideale", "https://blog.example/citta")]
+
+
+def _fuzzy_urls(keywords: list[str]) -> list[str]:
+    _, monologues = search.rank_monologues(DbType.MALE, keywords, fuzzy=True)
+    return [monologue.url for monologue in monologues]
+
+
+def test_fold_strips_case_and_accents():
+    assert fold("Perché") == "perche"
+    assert fold("CITTÀ") == "citta"
+    assert fold("perche") == fold("PERCHÈ")
+
+
+def test_swapped_letters_are_one_edit():
+    assert damerau_levenshtein("amlteo", "amleto") == 1
+    assert damerau_levenshtein("amleto", "amleto") == 0
+    assert damerau_levenshtein("amelto", "amleto") == 1
+    # Optimal string alignment, a swapped pair is not edited again
+    assert damerau_levenshtein("ca", "abc") == 3
+    assert damerau_levenshtein("kitten", "sitting") == 3
+    assert damerau_levenshtein("kitten", "sitting", limit=1) > 1
+
+
+def test_deletion_index_finds_words_within_the_distance():
+    index = DeletionIndex(["amleto", "amore", "mare", "madre"])
+    assert index.search("amlteo", 1) == [(1, "amleto")]
+    assert index.search("mdre", 1) == [(1, "madre"), (1, "mare")]
+    assert index.search("madre", 0) == [(0, "madre")]
+    assert index.search("xyz", 2) == []
+    assert len(index) == 4
+
+
+def test_short_words_match_exactly():
+    assert max_distance("mre") == 0
+    assert max_distance("amleto") == 1
+    assert max_distance("inverno") == 2
+
+
+def test_fuzzy_search_tolerates_accents_and_typos(indexes):
+    indexes({DbType.MALE: ROWS})
+
+    assert _fuzzy_urls(["perche"]) == ["https://blog.example/perche"]
+    assert _fuzzy_urls(["citta"]) == ["https://blog.example/citta"]
+    assert _fuzzy_urls(["amlteo"]) == ["https://blog.example/amleto"]
+    assert _fuzzy_urls(["invenro"]) == ["https://blog.example/mare"]
+
+    # Short words only without typos, accents apart
+    assert _fuzzy_urls(["mre"]) == []
+    assert _fuzzy_urls(["mare"]) == ["https://blog.example/mare"]
+
+
+def test_fuzzy_search_ranks_closer_words_first(indexes):
+    indexes({DbType.MALE: [("La madre", "https://blog.example/madre"),
+                           ("Il mare", "https://blog.example/mare")]})
+    assert _fuzzy_urls(["mare"]) == ["https://blog.example/mare", "https://blog.example/madre"]
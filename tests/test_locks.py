@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from const import DbType
+from locks import LOCK_KEY, UpdateLock
+
+redis = pytest.importorskip("redis")
+fakeredis = pytest.importorskip("fakeredis")
+# The lock is released and refreshed with Lua scripts
+pytest.importorskip("lupa")
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+
+
+def test_one_update_per_schema(client):
+    lock = UpdateLock(client)
+    token = lock.acquire(DbType.MALE)
+    assert token is not None
+    assert lock.is_locked(DbType.MALE)
+
+    # Joined by the other triggers, the other schema is free
+    assert lock.acquire(DbType.MALE) is None
+    assert UpdateLock(client).acquire(DbType.MALE) is None
+    assert lock.acquire(DbType.FEMALE) is not None
+
+    lock.release(DbType.MALE, token)
+    assert not lock.is_locked(DbType.MALE)
+    assert lock.acquire(DbType.MALE) is not None
+
+
+def test_only_the_holder_releases(client):
+    lock = UpdateLock(client)
+    token = lock.acquire(DbType.MALE)
+    lock.release(DbType.MALE, "someone-else")
+    lock.release(DbType.MALE, None)
+    assert lock.is_locked(DbType.MALE)
+    lock.release(DbType.MALE, token)
+    assert not lock.is_locked(DbType.MALE)
+
+
+def test_refresh_extends_the_holder_only(client):
+    lock = UpdateLock(client, ttl=100)
+    key = LOCK_KEY.format(schema=DbType.MALE.value)
+    token = lock.acquire(DbType.MALE)
+    client.expire(key, 5)
+
+    assert lock.refresh(DbType.MALE, token)
+    assert client.ttl(key) > 5
+    assert not lock.refresh(DbType.MALE, "someone-else")
+
+
+def test_lock_of_a_dead_update_expires(client):
+    lock = UpdateLock(client, ttl=1)
+    assert lock.acquire(DbType.MALE) is not None
+    time.sleep(1.1)
+    assert not lock.is_locked(DbType.MALE)
+    assert lock.acquire(DbType.MALE) is not None
+
+
+def test_falls_back_to_the_process_when_redis_fails():
+    class BrokenRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise redis.ConnectionError("down")
+            return fail
+
+    lock = UpdateLock(BrokenRedis())
+    token = lock.acquire(DbType.MALE)
+    assert token is not None
+    assert lock.acquire(DbType.MALE) is None
+    assert lock.refresh(DbType.MALE, token)
+    lock.release(DbType.MALE, token)
+    assert not lock.is_locked(DbType.MALE)
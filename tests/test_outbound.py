@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import RetryAfter  # noqa: E402
+
+from outbound import CHAT_BURST, OutboundRateLimiter, TokenBucket  # noqa: E402
+
+# Timers of the event loop may fire a bit early or late
+SLACK = 0.02
+
+
+def _send(limiter: OutboundRateLimiter, chat_id, sent: list, callback=None):
+    async def request():
+        sent.append(time.monotonic())
+        return True
+
+    return limiter.process_request(callback or request, (), {}, "sendMessage", {"chat_id": chat_id}, None)
+
+
+def test_token_bucket_bursts_then_spaces():
+    async def run() -> list[float]:
+        bucket = TokenBucket(rate=20, capacity=3)
+        start = time.monotonic()
+        times = []
+        for _ in range(6):
+            await bucket.acquire()
+            times.append(time.monotonic() - start)
+        return times
+
+    times = asyncio.run(run())
+    assert times[2] < SLACK
+    # The next ones one every 1 / rate
+    for earlier, later in zip(times[2:], times[3:]):
+        assert later - earlier >= 1 / 20 - SLACK
+
+
+def test_chat_burst_and_spacing():
+    limiter = OutboundRateLimiter(global_rate=1000, chat_rate=20)
+    sent = []
+    other = []
+
+    async def run() -> None:
+        await asyncio.gather(*(_send(limiter, 1, sent) for _ in range(CHAT_BURST + 3)),
+                             _send(limiter, 2, other))
+
+    start = time.monotonic()
+    asyncio.run(run())
+    times = sorted(t - start for t in sent)
+
+    assert times[CHAT_BURST - 1] < SLACK
+    for earlier, later in zip(times[CHAT_BURST - 1:], times[CHAT_BURST:]):
+        assert later - earlier >= 1 / 20 - SLACK
+    # The other chat has its own bucket
+    assert other[0] - start < SLACK
+
+
+def test_global_spacing():
+    limiter = OutboundRateLimiter(global_rate=10, chat_rate=1000)
+    sent = []
+
+    async def run() -> None:
+        # One message to each of 15 chats, the global bucket holds 10
+        await asyncio.gather(*(_send(limiter, chat_id, sent) for chat_id in range(1, 16)))
+
+    start = time.monotonic()
+    asyncio.run(run())
+    times = sorted(t - start for t in sent)
+
+    assert times[9] < SLACK
+    assert times[-1] >= 5 / 10 - SLACK
+
+
+def test_requests_without_chat_are_not_throttled():
+    limiter = OutboundRateLimiter(global_rate=1, chat_rate=1)
+    sent = []
+
+    async def run() -> None:
+        async def request():
+            sent.append(time.monotonic())
+
+        await asyncio.gather(*(limiter.process_request(request, (), {}, "answerCallbackQuery", {}, None)
+                               for _ in range(10)))
+
+    start = time.monotonic()
+    asyncio.run(run())
+    assert max(sent) - start < SLACK
+
+
+def test_retry_after_holds_and_retries():
+    limiter = OutboundRateLimiter(global_rate=1000, chat_rate=1000)
+    calls = []
+
+    async def flooded():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RetryAfter(0.2)
+        return True
+
+    start = time.monotonic()
+    assert asyncio.run(_send(limiter, 1, [], callback=flooded))
+    assert len(calls) == 2
+    assert calls[1] - start >= 0.2
+
+
+def test_retry_after_gives_up_after_max_retries():
+    limiter = OutboundRateLimiter(global_rate=1000, chat_rate=1000, max_retries=1)
+
+    async def flooded():
+        raise RetryAfter(0.01)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(_send(limiter, 1, [], callback=flooded))
+
+
+def test_overlapping_retry_after_hold_until_the_last():
+    limiter = OutboundRateLimiter(global_rate=1000, chat_rate=1000)
+    # Refused once by the flood control of each chat
+    delays = {1: 0.1, 2: 0.5}
+    sent = []
+
+    def flooded(chat_id: int):
+        async def request():
+            delay = delays.pop(chat_id, None)
+            if delay is not None:
+                raise RetryAfter(delay)
+            sent.append(time.monotonic())
+            return True
+        return request
+
+    async def run() -> None:
+        first = asyncio.gather(_send(limiter, 1, sent, callback=flooded(1)),
+                               _send(limiter, 2, sent, callback=flooded(2)))
+        # Queued while both waits run, released only when the longer ends
+        await asyncio.sleep(0.05)
+        await asyncio.gather(first, _send(limiter, 3, sent))
+
+    start = time.monotonic()
+    asyncio.run(run())
+    assert len(sent) == 3
+    assert min(sent) - start >= 0.5
@@ -0,0 +1,43 @@
+from render import MESSAGE_LIMIT, monologue_fragment, paginate
+
+
+def _fragments(count: int, title: str) -> list[tuple[str, int]]:
+    fragments = [monologue_fragment(f"{title} {i}", f"https://blog.example/monologo-{i}") for i in range(count)]
+    return [(fragment, len(fragment.encode())) for fragment in fragments]
+
+
+def test_pages_fit_the_limit_in_bytes():
+    # Multibyte titles, more bytes than characters
+    fragments = _fragments(300, "Perché è così — «città» 🎭")
+    header = "<b>Trovati 300 monologhi:</b>\n"
+    pages = paginate(header, fragments)
+
+    assert len(pages) > 1
+    assert all(len(page.encode()) <= MESSAGE_LIMIT for page in pages)
+    # Nothing lost, the header first and the fragments in order
+    assert pages[0].startswith(header)
+    assert "".join(pages) == header + "".join(fragment for fragment, _ in fragments)
+
+
+def test_pages_are_filled():
+    fragments = _fragments(300, "Amleto")
+    pages = paginate("", fragments)
+    # Every page is closed only when the next fragment does not fit
+    packed = 0
+    for page in pages[:-1]:
+        packed += page.count("<b>Nome:</b>")
+        assert len(page.encode()) + fragments[packed][1] > MESSAGE_LIMIT
+    assert packed + pages[-1].count("<b>Nome:</b>") == len(fragments)
+
+
+def test_empty_results_give_one_page():
+    assert paginate("", []) == ("",)
+    assert paginate("<b>Niente</b>\n", []) == ("<b>Niente</b>\n",)
+
+
+
+def test_fragment_escapes_title_and_url():
+    fragment = monologue_fragment("Romeo & Giulietta <atto I>", "https://blog.example/a?b=1&c=\"2\"")
+    assert "Romeo &amp; Giulietta &lt;atto I&gt;" in fragment
+    assert 'href="https://blog.example/a?b=1&amp;c=&quot;2&quot;"' in fragment
+    assert "<atto" not in fragment
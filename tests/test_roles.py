@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+
+import pytest
+
+from roles import (ROLE_ADMIN, ROLE_BANNED, ROLE_CREATOR, ROLE_USER, JsonRoleBackend, RoleService,
+                   SqliteRoleBackend)
+
+THREADS = 8
+CHANGES_PER_THREAD = 500
+USERS = 50
+
+
+class SlowBackend:
+    """
+    Backend taking its time to write, like a busy disk.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.roles: dict[str, str] = {}
+        self.saves = 0
+
+    def load(self) -> dict[str, str]:
+        return dict(self.roles)
+
+    def save(self, roles: dict[str, str], changes: dict[str, str]) -> None:
+        time.sleep(self.delay)
+        self.roles.update(changes)
+        self.saves += 1
+
+
+class BrokenBackend:
+    def __init__(self):
+        self.loads = 0
+
+    def load(self) -> dict[str, str]:
+        self.loads += 1
+        raise ConnectionError("Redis down")
+
+    def save(self, roles: dict[str, str], changes: dict[str, str]) -> None:
+        raise ConnectionError("Redis down")
+
+
+def _burst(service: RoleService) -> None:
+    """
+    THREADS threads promoting and banning the same users at the same time.
+    """
+    def work(number: int) -> None:
+        for i in range(CHANGES_PER_THREAD):
+            service.set_role((number * 7 + i) % USERS, ROLE_BANNED if (number + i) % 2 else ROLE_ADMIN)
+            service.is_banned(i % USERS)
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@pytest.mark.parametrize("make_backend", [
+    lambda path: JsonRoleBackend(str(path / "roles.json")),
+    lambda path: SqliteRoleBackend(str(path / "database.db")),
+], ids=["json", "sqlite"])
+def test_concurrent_bursts_are_persisted(tmp_path, make_backend):
+    service = RoleService(make_backend(tmp_path), flush_delay=0.01)
+    service.load()
+    _burst(service)
+    service.flush()
+
+    # What is read back is what the handlers saw last
+    memory = {str(user): service.get_role(user) for user in range(USERS)}
+    assert make_backend(tmp_path).load() == memory
+    assert set(memory.values()) == {ROLE_ADMIN, ROLE_BANNED}
+
+
+def test_handlers_do_not_wait_for_the_writes():
+    backend = SlowBackend(delay=0.05)
+    service = RoleService(backend, flush_delay=0.01)
+    service.load()
+
+    start = time.perf_counter()
+    _burst(service)
+    elapsed = time.perf_counter() - start
+    service.flush()
+
+    # Thousands of changes, written in a few batches
+    assert backend.saves < THREADS * CHANGES_PER_THREAD / 10
+    assert elapsed < THREADS * CHANGES_PER_THREAD * backend.delay / 100
+    assert backend.roles == {str(user): service.get_role(user) for user in range(USERS)}
+
+
+def test_failed_writes_are_retried(monkeypatch):
+    backend = SlowBackend(delay=0)
+    service = RoleService(backend, flush_delay=60)
+    service.load()
+    service.set_role(1, ROLE_BANNED)
+
+    def disk_full(roles, changes):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(backend, "save", disk_full)
+    service.flush()
+    assert backend.roles == {}
+
+    monkeypatch.undo()
+    service.set_role(2, ROLE_ADMIN)
+    service.flush()
+    assert backend.roles == {"1": ROLE_BANNED, "2": ROLE_ADMIN}
+
+
+def test_empty_backend_is_seeded_from_the_json_file(tmp_path):
+    with open(tmp_path / "roles.json", "w") as f:
+        json.dump({"1": ROLE_CREATOR, "2": ROLE_BANNED}, f)
+    seed = JsonRoleBackend(str(tmp_path / "roles.json"))
+
+    service = RoleService(SqliteRoleBackend(str(tmp_path / "database.db")), seed=seed)
+    service.load()
+    assert service.is_creator(1)
+    assert service.is_banned(2)
+    assert SqliteRoleBackend(str(tmp_path / "database.db")).load() == {"1": ROLE_CREATOR, "2": ROLE_BANNED}
+
+    # Imported once, the database is the source of the roles from now on
+    with open(tmp_path / "roles.json", "w") as f:
+        json.dump({"3": ROLE_CREATOR}, f)
+    service = RoleService(SqliteRoleBackend(str(tmp_path / "database.db")), seed=seed)
+    service.load()
+    assert service.is_creator(1)
+    assert not service.is_creator(3)
+
+
+def test_unreachable_backend_starts_with_no_roles():
+    backend = BrokenBackend()
+    service = RoleService(backend)
+    service.load()
+
+    # Every update asks, the backend is not read again
+    for user in range(100):
+        assert not service.is_banned(user)
+        assert service.get_role(user) == ROLE_USER
+    assert backend.loads == 1
+
+
+def test_redis_backend(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import roles
+
+    monkeypatch.setattr(roles.redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=fakeredis.FakeServer(), **kwargs))
+    backend = roles.RedisRoleBackend("redis://localhost")
+    service = RoleService(backend, flush_delay=0.01)
+    service.load()
+    _burst(service)
+    service.flush()
+    assert backend.load() == {str(user): service.get_role(user) for user in range(USERS)}
+
+
+def test_admin_feature_uses_the_shared_checks(monkeypatch):
+    pytest.importorskip("telegram")
+    import asyncio
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock
+
+    from commands import admin
+
+    service = RoleService(SlowBackend(delay=0), flush_delay=0.01)
+    service.load()
+    monkeypatch.setattr(admin, "is_banned", service.is_banned)
+    monkeypatch.setattr(admin, "is_admin_or_creator", service.is_admin_or_creator)
+    for user_id, role in ((1, ROLE_CREATOR), (2, ROLE_ADMIN), (3, ROLE_BANNED), (4, ROLE_USER)):
+        service.set_role(user_id, role)
+
+    def answer(user_id: int) -> str:
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id),
+                                 message=SimpleNamespace(reply_text=AsyncMock()))
+        asyncio.run(admin.admin_feature(update, SimpleNamespace()))
+        return update.message.reply_text.await_args.args[0]
+
+    assert answer(1) == answer(2) == "Admin feature accessed!"
+    assert answer(3) == "You are banned."
+    assert answer(4) == answer(5) == "Admins only."
+    service.flush()
@@ -0,0 +1,73 @@
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("bs4")
+pytest.importorskip("selenium")
+
+import scraper  # noqa: E402
+from conftest import read_fixture  # noqa: E402
+
+PAGE_URL = "https://www.recitazionecinematografica.com/category/monologhi-maschili?page=0"
+
+
+def test_parse_monologue_links():
+    links = scraper.parse_monologue_links(read_fixture("blog_page.html"), base_url=PAGE_URL)
+    assert links == [
+        {"url": "https://www.recitazionecinematografica.com/monologo-amleto-essere-o-non-essere",
+         "text": "Monologo di Amleto: essere o non essere"},
+        {"url": "https://www.recitazionecinematografica.com/monologo-perche-l-ho-fatto",
+         "text": "Perché l'ho fatto & altre domande"},
+    ]
+
+
+def test_parse_monologue_links_without_posts():
+    assert scraper.parse_monologue_links(read_fixture("empty_page.html"), base_url=PAGE_URL) == []
+
+
+def test_parse_pagination_counter():
+    assert scraper.parse_pagination_counter(read_fixture("blog_page.html")) == 42
+    assert scraper.parse_pagination_counter(read_fixture("empty_page.html")) is None
+
+
+def test_parse_article_body():
+    assert scraper.parse_article_body(read_fixture("article.html")) == (
+        "Monologo di Amleto: essere o non essere\n"
+        "Essere, o non essere, questo è il dilemma:\n"
+        "se sia più nobile all'animo sopportare\n"
+        "gli oltraggi, i sassi e i dardi dell'iniqua fortuna,\n"
+        "o prender l'armi contro un mare di triboli."
+    )
+
+
+def _http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+@pytest.mark.parametrize("error, expected", [
+    (_http_error(404), ""),
+    (_http_error(503), None),
+    (requests.ConnectionError("down"), None),
+])
+def test_fetch_article_body_errors(monkeypatch, error, expected):
+    def fetch_page(url, session=None):
+        raise error
+
+    monkeypatch.setattr(scraper, "fetch_page", fetch_page)
+    assert scraper.fetch_article_body("https://blog.example/amleto") == expected
+
+
+def test_async_monologue_scraper_falls_back_to_chrome(monkeypatch):
+    monkeypatch.setattr(scraper, "fetch_page", lambda url, session=None: read_fixture("empty_page.html"))
+    monkeypatch.setattr(scraper, "chrome_monologue_scraper",
+                        lambda url, session=None: [{"url": url, "text": "Da Chrome"}])
+    assert scraper.async_monologue_scraper(PAGE_URL) == [{"url": PAGE_URL, "text": "Da Chrome"}]
+
+
+def test_async_monologue_scraper_records_timings(monkeypatch):
+    monkeypatch.setattr(scraper, "fetch_page", lambda url, session=None: read_fixture("blog_page.html"))
+    with scraper.DriverSession() as session:
+        links = scraper.async_monologue_scraper(PAGE_URL, session=session)
+    assert len(links) == 2
+    assert [(timing.url, timing.engine) for timing in session.timings] == [(PAGE_URL, "http")]
@@ -0,0 +1,196 @@
+import random
+import re
+import time
+
+import search
+from conftest import MAX_KEYSTROKE_P99, make_rows, percentile
+from const import DbType
+from fuzzy import fold
+
+POSTS = [{"url": f"https://blog.example/monologo-{i}", "text": title}
+         for i, title in enumerate(["Amleto, essere o non essere", "Ofelia e il rosmarino", "Il padre di Amleto"])]
+
+
+def _add_bodies(store, texts: dict[str, str]) -> None:
+    missing = dict((url, monologue_id) for monologue_id, url in store.missing_bodies(DbType.MALE, limit=100))
+    store.add_bodies([(missing[url], text) for url, text in texts.items()])
+
+
+def test_new_bodies_keep_the_title_index(store):
+    store.upsert(DbType.MALE, POSTS)
+    first = search.load_indexes()[DbType.MALE]
+
+    _add_bodies(store, {POSTS[0]["url"]: "Essere o non essere, questo è il dilemma"})
+    second = search.load_indexes()[DbType.MALE]
+    assert second is not first
+    assert second._postings is first._postings
+    assert second._deletions is first._deletions
+    assert second.fragments is first.fragments
+    assert len(first.bodies) == 0 and len(second.bodies) == 1
+
+    # Only the new bodies are indexed, added to the previous ones
+    _add_bodies(store, {POSTS[1]["url"]: "Ecco del rosmarino, è per ricordare"})
+    third = search.load_indexes()[DbType.MALE]
+    assert third._postings is first._postings
+    assert len(third.bodies) == 2
+    assert search.rank_bodies(DbType.MALE, ["dilemma"])[0] == 1
+    assert search.rank_bodies(DbType.MALE, ["ricordare"])[1][0].url == POSTS[1]["url"]
+
+
+def test_new_titles_rebuild_the_title_index(store):
+    store.upsert(DbType.MALE, POSTS)
+    _add_bodies(store, {POSTS[0]["url"]: "Essere o non essere"})
+    first = search.load_indexes()[DbType.MALE]
+
+    store.upsert(DbType.MALE, [{"url": "https://blog.example/monologo-3", "text": "Re Lear nella tempesta"}])
+    assert search.reload_if_changed()
+    second = search.get_index(DbType.MALE)
+    assert second._postings is not first._postings
+    assert second.bodies is first.bodies
+    assert search.rank_monologues(DbType.MALE, ["tempesta"])[0] == 1
+
+
+def test_unchanged_database_is_not_reloaded(store):
+    store.upsert(DbType.MALE, POSTS)
+    search.load_indexes()
+    store.set_metadata(DbType.MALE, total_pages=1, last_update="01/01/2024")
+    assert not search.reload_if_changed()
+
+
+def test_lookup_equals_the_linear_scan():
+    rows = make_rows(2000)
+    index = search.MonologueIndex.from_rows(rows)
+    titles = [title.casefold() for title, _ in rows]
+    rng = random.Random(0)
+
+    keys = ["Amore", "PERCHÉ", "é", "à ", " o", "xyz", "amore amore", "0", "1999"]
+    for size in (1, 2, 3, 4, 5, 8, 12):
+        for _ in range(20):
+            title = rng.choice(titles)
+            start = rng.randrange(max(1, len(title) - size))
+            keys.append(title[start:start + size])
+
+    for key in keys:
+        assert index.lookup(key) == [i for i, t in enumerate(titles) if key.casefold() in t], key
+
+
+def _keystrokes(text: str) -> list[str]:
+    return [text[:end] for end in range(1, len(text) + 1)]
+
+
+def test_complete_monologues_keystroke_stream(indexes):
+    rows = make_rows(10000)
+    indexes({DbType.MALE: rows, DbType.FEMALE: make_rows(10000, seed=1)})
+    latencies = []
+
+    for title, url in rows[:20]:
+        typed = " ".join(title.split()[:3])
+        for query in _keystrokes(typed):
+            # An inline answer completes both schemas
+            start = time.perf_counter()
+            results = search.complete_monologues(DbType.MALE, query, limit=20)
+            search.complete_monologues(DbType.FEMALE, query, limit=20)
+            latencies.append(time.perf_counter() - start)
+
+            *words, last = [fold(word) for word in re.findall(r"\w+", query)]
+            if query[-1].isspace():
+                words, last = [*words, last], None
+            for result_title, _, fragment in results:
+                title_words = set(re.findall(r"\w+", fold(result_title)))
+                assert set(words) <= title_words
+                assert last is None or any(word.startswith(last) for word in title_words)
+                assert result_title in fragment
+
+        # The whole title typed, the monologue is among the answers
+        assert url in [result_url for _, result_url, _ in
+                       search.complete_monologues(DbType.MALE, title, limit=20)]
+
+    assert percentile(latencies, 0.99) < MAX_KEYSTROKE_P99, f"p99 {percentile(latencies, 0.99):.4f}s"
+
+
+def _ranked(keywords: list[str]) -> list[str]:
+    _, monologues = search.rank_monologues(DbType.MALE, keywords, limit=None)
+    return [monologue.text for monologue in monologues]
+
+
+def test_more_keywords_rank_first(indexes):
+    indexes({DbType.MALE: [("Amore", "u1"), ("Guerra e pace", "u2"), ("Amore e guerra", "u3")]})
+    assert _ranked(["amore", "guerra"])[0] == "Amore e guerra"
+
+
+def test_whole_words_rank_before_substrings(indexes):
+    indexes({DbType.MALE: [("Amoreggiare", "u1"), ("Il mio amore", "u2")]})
+    assert _ranked(["amore"]) == ["Il mio amore", "Amoreggiare"]
+
+
+def test_earlier_keywords_rank_first(indexes):
+    indexes({DbType.MALE: [("Il mio amore", "u1"), ("Amore mio", "u2"), ("Per amore", "u3")]})
+    assert _ranked(["amore"]) == ["Amore mio", "Per amore", "Il mio amore"]
+
+
+def test_required_keywords_must_all_match(indexes):
+    indexes({DbType.MALE: [("Amore", "u1"), ("Guerra e pace", "u2"), ("Amore e guerra", "u3"),
+                           ("Amore, guerra e pace", "u4")]})
+    assert sorted(_ranked(["+amore", "+guerra"])) == ["Amore e guerra", "Amore, guerra e pace"]
+    # The optional keywords only rank the monologues with the required ones
+    assert _ranked(["+amore", "pace"])[0] == "Amore, guerra e pace"
+    assert "Guerra e pace" not in _ranked(["+amore", "pace"])
+    assert search.rank_monologues(DbType.MALE, ["+amore", "+tempesta"]) == (0, [])
+
+
+def test_repeated_keywords_count_once(indexes):
+    indexes({DbType.MALE: [("Amore", "u1"), ("Guerra", "u2"), ("Amore e guerra", "u3")]})
+    assert _ranked(["amore", "amore", "guerra"]) == _ranked(["amore", "guerra"])
+    assert _ranked(["+amore", "amore", "guerra"])[0] == "Amore e guerra"
+    # Ties keep the order of the index, repeated keywords do not break them
+    assert _ranked(["amore", "amore", "guerra"])[1:] == ["Amore", "Guerra"]
+
+
+def test_top_k_equals_the_full_sort(indexes):
+    indexes({DbType.MALE: make_rows(2000)})
+    for keywords in (["amore"], ["amore", "notte", "mare"], ["+padre", "figlio"], ["a", "e", "o"]):
+        total, every = search.rank_monologues(DbType.MALE, keywords, limit=None)
+        assert total == len(every)
+        for limit in (1, 10, 50):
+            assert search.rank_monologues(DbType.MALE, keywords, limit=limit) == (total, every[:limit])
+
+
+class StopWatching(BaseException):
+    """
+    Ends the loop of the index watcher in the tests.
+    """
+
+
+def test_watcher_subscribes_again_after_a_redis_error(monkeypatch):
+    subscriptions = []
+    waits = []
+
+    class PubSub:
+        def close(self):
+            self.closed = True
+
+    def subscribe():
+        subscriptions.append(PubSub())
+        return subscriptions[-1]
+
+    def wait(pubsub, timeout):
+        waits.append(pubsub)
+        if len(waits) == 1:
+            raise ConnectionError("broker restarted")
+        if len(waits) == 3:
+            raise StopWatching()
+
+    monkeypatch.setattr(search, "subscribe_database_updates", subscribe)
+    monkeypatch.setattr(search, "wait_database_update", wait)
+    monkeypatch.setattr(search, "reload_if_changed", lambda: False)
+    monkeypatch.setattr(search.time, "sleep", lambda seconds: None)
+
+    try:
+        search._watch(interval=60)
+    except StopWatching:
+        pass
+
+    # The broken subscription is closed, the next ones use a new one
+    assert len(subscriptions) == 2
+    assert subscriptions[0].closed
+    assert waits == [subscriptions[0], subscriptions[1], subscriptions[1]]
@@ -0,0 +1,114 @@
+from const import DbType
+
+POSTS = [{"url": "https://blog.example/amleto", "text": "Amleto"},
+         {"url": "https://blog.example/ofelia", "text": "Ofelia"}]
+
+
+def test_upsert_counts_new_monologues(store):
+    assert store.upsert(DbType.MALE, POSTS) == 2
+    assert store.upsert(DbType.MALE, POSTS) == 0
+    assert store.monologues(DbType.MALE) == [("Amleto", "https://blog.example/amleto"),
+                                             ("Ofelia", "https://blog.example/ofelia")]
+    assert store.monologues(DbType.FEMALE) == []
+
+
+def test_generation_follows_the_monologues(store):
+    store.upsert(DbType.MALE, POSTS)
+    generation = store.generation()
+
+    # Same titles, nothing for the readers to reload
+    store.upsert(DbType.MALE, POSTS)
+    assert store.generation() == generation
+
+    store.upsert(DbType.MALE, [{"url": "https://blog.example/amleto", "text": "Amleto, atto III"}])
+    assert store.generation() == generation + 1
+
+
+def test_metadata_does_not_bump_the_generation(store):
+    store.upsert(DbType.MALE, POSTS)
+    generation = store.generation()
+
+    store.set_metadata(DbType.MALE, total_pages=3, last_update="01/01/2024", etag="a")
+    store.set_metadata(DbType.MALE, total_pages=3, last_update="01/01/2024", etag="a")
+    store.set_metadata(DbType.MALE, total_pages=4, last_update="02/01/2024", etag="b")
+
+    assert store.generation() == generation
+    assert store.metadata(DbType.MALE)["etag"] == "b"
+
+
+def test_update_run_bumps_the_generation_once(store):
+    generation = store.generation()
+    with store.transaction():
+        store.upsert(DbType.MALE, POSTS)
+        store.set_metadata(DbType.MALE, total_pages=1, last_update="01/01/2024")
+    assert store.generation() == generation + 1
+
+    # A run finding only known monologues
+    with store.transaction():
+        store.upsert(DbType.MALE, POSTS)
+        store.set_metadata(DbType.MALE, total_pages=1, last_update="02/01/2024")
+    assert store.generation() == generation + 1
+
+
+def test_failed_transaction_is_rolled_back(store):
+    generation = store.generation()
+    try:
+        with store.transaction():
+            store.upsert(DbType.MALE, POSTS)
+            raise RuntimeError("crash")
+    except RuntimeError:
+        pass
+    assert store.monologues(DbType.MALE) == []
+    assert store.generation() == generation
+
+
+def test_bodies_are_stored_once(store):
+    store.upsert(DbType.MALE, POSTS)
+    (amleto_id, _), (ofelia_id, _) = store.missing_bodies(DbType.MALE, limit=10)
+    store.add_bodies([(amleto_id, "Essere o non essere")])
+    generation = store.generation()
+
+    store.add_bodies([(amleto_id, "Altro testo")])
+    assert store.generation() == generation
+    store.add_bodies([(ofelia_id, "Ecco del rosmarino")])
+    assert store.generation() == generation + 1
+
+    bodies = store.bodies(DbType.MALE)
+    assert [text for _, _, text in bodies] == ["Essere o non essere", "Ecco del rosmarino"]
+    assert store.bodies(DbType.MALE, after_id=bodies[0][0]) == bodies[1:]
+    assert store.missing_bodies(DbType.MALE, limit=10) == []
+
+
+def _write_json_database(path) -> None:
+    import json
+
+    database = {DbType.MALE.value: {"list": POSTS, "total_pages": 3, "last_update": "01/01/2024"}}
+    with open(path, "w") as f:
+        json.dump(database, f)
+
+
+def test_new_store_imports_the_json_database(tmp_path):
+    from storage import MonologueStore
+
+    json_path = tmp_path / "database.json"
+    _write_json_database(json_path)
+    store = MonologueStore(str(tmp_path / "database.db"), json_path=str(json_path))
+    assert [url for _, url in store.monologues(DbType.MALE)] == [post["url"] for post in POSTS]
+    assert store.metadata(DbType.MALE)["total_pages"] == 3
+    generation = store.generation()
+    store.close()
+
+    # Imported once, the next starts find the monologues already there
+    store = MonologueStore(str(tmp_path / "database.db"), json_path=str(json_path))
+    assert store.generation() == generation
+    store.close()
+
+
+def test_broken_json_database_leaves_the_store_empty(tmp_path):
+    from storage import MonologueStore
+
+    json_path = tmp_path / "database.json"
+    json_path.write_text("{not json")
+    store = MonologueStore(str(tmp_path / "database.db"), json_path=str(json_path))
+    assert store.is_empty()
+    store.close()
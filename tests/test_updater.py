@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("celery")
+pytest.importorskip("requests")
+pytest.importorskip("bs4")
+pytest.importorskip("selenium")
+
+import scraper  # noqa: E402
+import updater  # noqa: E402
+from celery_app import app as celery_app  # noqa: E402
+from const import DbType, URL_BY_TYPE  # noqa: E402
+from locks import update_lock  # noqa: E402
+from scraper import FirstPage, RateLimiter  # noqa: E402
+
+POSTS_PER_PAGE = 3
+TOTAL_PAGES = 8
+
+
+def _posts(page: int) -> list[dict]:
+    base = URL_BY_TYPE[DbType.MALE.value]
+    return [{"url": f"{base}/monologo-{page}-{i}", "text": f"Monologo {page} {i}"} for i in range(POSTS_PER_PAGE)]
+
+
+def _page_html(page: int) -> str:
+    links = "".join(f'<a class="BlogPostAnnounceHeaderLinkUi-x" href="{post["url"]}">{post["text"]}</a>'
+                    for post in _posts(page))
+    return f"<html><body>{links}</body></html>"
+
+
+@pytest.fixture
+def eager(monkeypatch):
+    """
+    Celery tasks run in the calling process, chords included.
+    """
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    monkeypatch.setattr(celery_app.conf, "task_eager_propagates", True)
+
+
+@pytest.fixture
+def blog(monkeypatch):
+    """
+    The blog as saved pages, no network. Collects the pages requested.
+    """
+    requested = []
+
+    def fetch_page(url, session=None):
+        page = int(url.rsplit("?page=", 1)[1])
+        requested.append(page)
+        return _page_html(page)
+
+    monkeypatch.setattr(updater, "probe_first_page",
+                        lambda url, etag=None, last_modified=None, session=None:
+                        FirstPage(_posts(0), TOTAL_PAGES, etag="v2"))
+    monkeypatch.setattr(scraper, "fetch_page", fetch_page)
+    monkeypatch.setattr(updater, "fetch_article_body", lambda url: f"Testo di {url}")
+    return requested
+
+
+def test_update_fans_out_pages_in_chords(eager, blog, store, caplog):
+    # The last run stopped at page 3, newer monologues have been published since
+    store.upsert(DbType.MALE, _posts(3) + _posts(4))
+    caplog.set_level(logging.INFO, logger="scraper")
+
+    updater.update_monologues.delay(DbType.MALE.value)
+
+    # Batches of 1 then 2 pages, stopped at the first known page
+    assert blog == [1, 2, 3]
+    urls = store.urls(DbType.MALE)
+    assert all(post["url"] in urls for page in range(5) for post in _posts(page))
+    assert store.metadata(DbType.MALE)["etag"] == "v2"
+    assert store.missing_bodies(DbType.MALE, limit=100) == []
+    assert not update_lock.is_locked(DbType.MALE)
+
+    # Every page task logs its timings, like the single process updates
+    timings = [record.getMessage() for record in caplog.records if "via http" in record.getMessage()]
+    assert len(timings) == 3
+
+
+def test_update_joins_the_running_one(eager, blog, store):
+    token = update_lock.acquire(DbType.MALE)
+    try:
+        updater.update_monologues.delay(DbType.MALE.value)
+        assert blog == []
+        assert store.monologues(DbType.MALE) == []
+    finally:
+        update_lock.release(DbType.MALE, token)
+
+
+def test_failed_page_releases_the_lock(eager, blog, store, monkeypatch):
+    def fetch_page(url, session=None):
+        raise ValueError("broken page")
+
+    monkeypatch.setattr(scraper, "fetch_page", fetch_page)
+    with pytest.raises(ValueError):
+        updater.update_monologues.delay(DbType.MALE.value)
+    assert not update_lock.is_locked(DbType.MALE)
+    assert store.monologues(DbType.MALE) == []
+
+
+def test_rate_limit_is_shared_by_the_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    min_interval = 0.1
+    # One limiter per worker process, the same Redis
+    workers = [RateLimiter(min_interval, fakeredis.FakeStrictRedis(server=server)) for _ in range(2)]
+    starts = []
+    starts_lock = threading.Lock()
+
+    def scrape(limiter: RateLimiter) -> None:
+        for _ in range(3):
+            limiter.wait("https://www.recitazionecinematografica.com/page")
+            with starts_lock:
+                starts.append(time.monotonic())
+
+    threads = [threading.Thread(target=scrape, args=(limiter,)) for limiter in workers for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    starts.sort()
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert len(starts) == 12
+    # Threads note the time after the wait, scheduling may shorten a gap a bit,
+    # without the shared slot the two workers would go at the same time
+    assert min(gaps) >= min_interval / 2
+
+
+def test_dead_chord_releases_the_lock(store, monkeypatch):
+    from celery.app.task import Context
+
+    chords = []
+    monkeypatch.setattr(updater, "chord", lambda header: lambda callback: chords.append(callback))
+    token = update_lock.acquire(DbType.MALE)
+    state = {"first_page": {"blog_posts": [], "total_pages": TOTAL_PAGES},
+             "blog_posts": [], "next_page": 1, "batch_size": 1, "lock": token}
+    updater._fan_out(DbType.MALE, state)
+
+    # What the result backend does when a page of the chord fails for good
+    callback, = chords
+    request = Context(id="commit", errbacks=callback.options["link_error"], delivery_info={})
+    celery_app.backend._call_task_errbacks(request, ValueError("broken page"), None)
+
+    assert not update_lock.is_locked(DbType.MALE)
+
+
+class FakeSession:
+    """
+    DriverSession of the tests, counts the sessions and their closes.
+    """
+    opened = []
+
+    def __init__(self):
+        self.timings = []
+        self.closed = 0
+        FakeSession.opened.append(self)
+
+    def close(self):
+        self.closed += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    monkeypatch.setattr(FakeSession, "opened", [])
+    monkeypatch.setattr(updater, "DriverSession", FakeSession)
+    monkeypatch.setattr(updater, "_session", None)
+    return FakeSession.opened
+
+
+def test_probe_uses_one_session(eager, blog, store, sessions, monkeypatch):
+    probed = []
+    monkeypatch.setattr(updater, "probe_first_page",
+                        lambda url, etag=None, last_modified=None, session=None:
+                        probed.append(session))
+
+    updater.update_monologues.delay(DbType.MALE.value)
+    assert probed == sessions and len(sessions) == 1
+    assert sessions[0].closed == 1
+
+
+def test_page_tasks_share_the_worker_chrome(eager, sessions, monkeypatch):
+    used = []
+    monkeypatch.setattr(updater, "async_monologue_scraper",
+                        lambda url, session=None: used.append(session) or _posts(1))
+
+    for page in range(1, 4):
+        updater.scrape_page_task.delay(DbType.MALE.value, page)
+    assert len(sessions) == 1 and used == sessions * 3
+    assert sessions[0].closed == 0
+
+    # The worker process stops, its Chrome quits
+    from celery.signals import worker_process_shutdown
+    worker_process_shutdown.send(sender=None)
+    assert sessions[0].closed == 1
+    updater.scrape_page_task.delay(DbType.MALE.value, 1)
+    assert len(sessions) == 2
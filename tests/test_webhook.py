@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from conftest import read_fixture  # noqa: E402
+from telegram import Bot  # noqa: E402
+from webhook import HEALTH_PATH, MAX_BODY_SIZE, SECRET_HEADER, WEBHOOK_PATH, WebhookApp  # noqa: E402
+
+SECRET = "s3cret"
+
+
+@pytest.fixture
+def application():
+    return SimpleNamespace(bot=Bot("123456:TEST"), update_queue=asyncio.Queue())
+
+
+def _request(webhook: WebhookApp, method: str = "POST", path: str = WEBHOOK_PATH, body: bytes = b"",
+             secret: str = SECRET) -> int:
+    """
+    Drive the ASGI app like uvicorn does, the body in two chunks.
+    :return: the HTTP status of the answer
+    """
+    scope = {"type": "http", "method": method, "path": path, "client": ("127.0.0.1", 5000),
+             "headers": [(b"content-type", b"application/json"), (SECRET_HEADER, secret.encode())]}
+    chunks = [{"type": "http.request", "body": body[:10], "more_body": True},
+              {"type": "http.request", "body": body[10:], "more_body": False}]
+    sent = []
+
+    async def receive():
+        return chunks.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(webhook(scope, receive, send))
+    start, end = sent
+    assert end == {"type": "http.response.body", "body": b""}
+    return start["status"]
+
+
+def test_recorded_update_is_queued(application):
+    webhook = WebhookApp(application, SECRET)
+    assert _request(webhook, body=read_fixture("update.json").encode()) == 200
+
+    update = application.update_queue.get_nowait()
+    assert update.update_id == 284731902
+    assert update.message.text == "/start"
+    assert update.effective_chat.id == 123456789
+
+
+def test_bad_secret_is_refused(application):
+    webhook = WebhookApp(application, SECRET)
+    assert _request(webhook, body=read_fixture("update.json").encode(), secret="wrong") == 403
+    assert _request(webhook, body=read_fixture("update.json").encode(), secret="") == 403
+    assert application.update_queue.empty()
+
+
+def test_malformed_body_is_refused(application):
+    webhook = WebhookApp(application, SECRET)
+    assert _request(webhook, body=b"[1, 2, 3]") == 400
+    assert _request(webhook, body=b"{not json") == 400
+    assert _request(webhook, body=b" " * (MAX_BODY_SIZE + 1)) == 413
+    assert application.update_queue.empty()
+
+
+def test_other_methods_and_paths(application):
+    webhook = WebhookApp(application, SECRET)
+    assert _request(webhook, method="GET") == 405
+    assert _request(webhook, method="GET", path=HEALTH_PATH) == 200
+    assert _request(webhook, path="/other") == 404
+
+
+def test_lifespan_starts_and_stops_the_bot():
+    application = SimpleNamespace(initialize=AsyncMock(), start=AsyncMock(), stop=AsyncMock(),
+                                  shutdown=AsyncMock())
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    asyncio.run(WebhookApp(application, SECRET)({"type": "lifespan"}, receive, send))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    for step in (application.initialize, application.start, application.stop, application.shutdown):
+        step.assert_awaited_once()